@@ -0,0 +1,98 @@
+"""Import time of the packages, each statement measured in a fresh interpreter with "python -X importtime".
+
+Usage (from the repository root):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeat 10 --max-ms 150
+
+Reports the cumulative import time of every statement (best of --repeat runs), the slowest modules it loaded
+and whether it pulled in the heavy optional dependencies (PIL, aiohttp).
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# komga/config.py is not versioned, a placeholder is installed so that komga can be imported anywhere.
+CONFIG_STUB = (
+    "import sys, types; config = types.ModuleType('komga.config'); "
+    "config.KOMGA_CONFIG = {'base_URL': '', 'user': '', 'password': ''}; sys.modules['komga.config'] = config"
+)
+
+STATEMENTS = [
+    "import providers",
+    "from providers import MangaDex",
+    "from providers import CompositeProvider",
+    "from providers import AsyncMangaDex",
+    "from komga import KomgaConnector",
+    "import manga_metadata.__main__"
+]
+
+HEAVY_MODULES = ["PIL", "aiohttp"]
+
+STATEMENT_MARKER = "import_time: statement\n"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.import_time", description="Measure the import time of the packages.")
+    parser.add_argument("statements", nargs="*", default=STATEMENTS, help="Import statements to measure. Defaults to the public entry points.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per statement, the fastest is reported.")
+    parser.add_argument("--top", type=int, default=5, help="Slowest modules listed per statement.")
+    parser.add_argument("--max-ms", type=float, default=None, help="Exit with 1 if a statement takes longer than this.")
+
+    return parser
+
+
+def measure(statement:str) -> dict:
+    """Import statement in a fresh interpreter.
+
+    Returns:
+        dict: "total_ms" cumulative import time of the modules imported by statement,
+        "modules" cumulative milliseconds of each imported module and "heavy" the HEAVY_MODULES loaded.
+    """
+    code = f"{CONFIG_STUB}\nsys.stderr.write({STATEMENT_MARKER!r})\n{statement}\nprint(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT_DIR, capture_output=True, text=True)
+
+    if(process.returncode != 0):
+        raise RuntimeError(f"{statement!r} failed:\n{process.stderr}")
+
+    modules = {}
+    total = 0
+    # Modules imported at startup (site, encodings...) are logged before the marker and are not counted.
+    for line in process.stderr.split(STATEMENT_MARKER, 1)[-1].splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if(not line.startswith("import time:") or "[us]" in line):
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name_depth = len(name) - len(name.lstrip())
+        modules[name.strip()] = int(cumulative) / 1000
+
+        # Top level imports are the least indented, their cumulative times add up to the whole statement.
+        if(name_depth == 1):
+            total += int(cumulative) / 1000
+
+    return {"total_ms": total, "modules": modules, "heavy": [name for name in process.stdout.strip().split(",") if name]}
+
+
+def main(argv:list[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    over_budget = False
+
+    for statement in args.statements:
+        result = min((measure(statement) for _ in range(max(1, args.repeat))), key=lambda run: run["total_ms"])
+        slowest = sorted(result["modules"].items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+        print(f"{statement}: {result['total_ms']:.1f} ms, heavy modules: {', '.join(result['heavy']) or 'none'}")
+        for name, milliseconds in slowest:
+            print(f"  {name}: {milliseconds:.1f} ms")
+
+        if(args.max_ms is not None and result["total_ms"] > args.max_ms):
+            over_budget = True
+
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Offline benchmark of the sync pipeline against the local stub servers.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmark --series 500 --latency 0.05 --rate-limit-probability 0.02 --output run.json
+    python -m benchmarks.run_benchmark --compare run.json
+
+Reports series/second, p50/p99 of every pipeline stage and peak RSS, and can save them to compare runs.
+"""
+import argparse
+import json
+import resource
+import sys
+import types
+
+from providers import MangaDex, MangaUpdates, CompositeProvider, HttpTransport, RateLimiter, MetricsRegistry
+from .stub_servers import Library, StubServer, StubOptions, MangaDexHandler, MangaUpdatesHandler, KomgaHandler
+
+PROVIDERS = {
+    "mangadex": MangaDex,
+    "mangaupdates": MangaUpdates
+}
+
+# Real hosts of the providers, their RateLimiter.DEFAULT_LIMITS are applied to the stubs with --throttle.
+PROVIDER_HOSTS = {
+    "mangadex": "api.mangadex.org",
+    "mangaupdates": "api.mangaupdates.com"
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run_benchmark", description="Benchmark the sync pipeline against local stub servers.")
+    parser.add_argument("--series", type=int, default=200, help="Series in the stub Komga library.")
+    parser.add_argument("--provider", choices=list(PROVIDERS.keys()) + ["all"], default="mangadex")
+    parser.add_argument("--strategy", choices=CompositeProvider.STRATEGIES, default="merge")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every provider response.")
+    parser.add_argument("--komga-latency", type=float, default=0.005, help="Seconds added to every Komga response.")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Random seconds added on top of the latencies.")
+    parser.add_argument("--rate-limit-probability", type=float, default=0, help="Probability of a provider answering 429.")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After of the injected 429s, in seconds.")
+    parser.add_argument("--summary-size", type=int, default=500, help="Characters of the summaries, controls the JSON payload size.")
+    parser.add_argument("--cover-size", type=int, nargs=2, default=[1000, 1500], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--throttle", action="store_true", help="Apply the real providers' rate limits to the stubs.")
+    parser.add_argument("--no-cover", action="store_true", help="Do not download and upload cover art.")
+    parser.add_argument("--search-workers", type=int, default=None)
+    parser.add_argument("--fetch-workers", type=int, default=None)
+    parser.add_argument("--upload-workers", type=int, default=None)
+    parser.add_argument("--cover-processes", type=int, default=None)
+    parser.add_argument("--output", help="Save the results as JSON.")
+    parser.add_argument("--metrics", help="Save the request and step metrics in the Prometheus text format.")
+    parser.add_argument("--compare", help="Results saved with --output to compare this run with.")
+
+    return parser
+
+
+def install_komga_config() -> None:
+    """Let komga be imported without a komga/config.py, the real values are set once the stub is running."""
+    try:
+        import komga.config
+
+    except ImportError:
+        config = types.ModuleType("komga.config")
+        config.KOMGA_CONFIG = {"base_URL": "", "user": "benchmark", "password": "benchmark"}
+        sys.modules["komga.config"] = config
+
+
+def point_providers_at(mangadex_url:str, mangaupdates_url:str, throttle:bool) -> None:
+    MangaDex.BASE_URL = mangadex_url
+    MangaDex.COVERS_URL = f"{mangadex_url}/covers"
+    MangaUpdates.BASE_URL = mangaupdates_url
+
+    for name, provider in PROVIDERS.items():
+        # Every stub listens on 127.0.0.1, so each provider gets its own limiter instead of sharing one bucket.
+        limits = {"127.0.0.1": RateLimiter.DEFAULT_LIMITS[PROVIDER_HOSTS[name]]} if throttle else {}
+        provider.set_transport(HttpTransport(
+            pool_connections=32,
+            pool_maxsize=32,
+            rate_limiter=RateLimiter(limits),
+            max_rate_limit_retries=10,
+            name=provider.PROVIDER_NAME
+        ))
+
+
+def peak_rss_mb() -> dict[str, float]:
+    # ru_maxrss is in kilobytes on Linux.
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    }
+
+
+def run(args:argparse.Namespace) -> dict:
+    install_komga_config()
+
+    from komga import KomgaConnector
+    from manga_metadata import SyncPipeline
+
+    library = Library(series_count=args.series, summary_size=args.summary_size, cover_size=tuple(args.cover_size))
+    provider_options = StubOptions(args.latency, args.jitter, args.rate_limit_probability, args.retry_after)
+
+    with StubServer(MangaDexHandler, library, provider_options) as mangadex, \
+         StubServer(MangaUpdatesHandler, library, provider_options) as mangaupdates, \
+         StubServer(KomgaHandler, library, StubOptions(args.komga_latency, args.jitter)) as komga_server:
+
+        point_providers_at(mangadex.url, mangaupdates.url, args.throttle)
+        KomgaConnector.KOMGA_BASE_URL = komga_server.url
+
+        if(args.provider == "all"):
+            provider = CompositeProvider(list(PROVIDERS.values()), strategy=args.strategy)
+
+        else:
+            provider = PROVIDERS[args.provider]
+
+        workers = {"search": args.search_workers, "fetch": args.fetch_workers, "upload": args.upload_workers}
+
+        komga = KomgaConnector(pool_maxsize=32)
+
+        pipeline = SyncPipeline(
+            komga,
+            provider,
+            workers={stage: count for stage, count in workers.items() if count is not None},
+            update_cover_art=not args.no_cover,
+            cover_processes=args.cover_processes
+        )
+
+        summary = pipeline.run([KomgaHandler.LIBRARY_ID])
+
+        komga.close()
+
+        if(isinstance(provider, CompositeProvider)):
+            provider.close()
+
+    return {
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "metrics")},
+        "series": summary.enumerated,
+        "updated": summary.updated,
+        "failed": summary.failed,
+        "elapsed_seconds": summary.elapsed_seconds,
+        "series_per_second": summary.series_per_second,
+        "stages": {
+            name: {"p50_ms": stats.percentile(50) * 1000, "p99_ms": stats.percentile(99) * 1000, "processed": stats.processed}
+            for name, stats in summary.stages.items()
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": summary.errors[:10]
+    }
+
+
+def report(results:dict, baseline:dict = None) -> str:
+    def change(path:list[str]) -> str:
+        if(baseline is None):
+            return ""
+
+        current, previous = results, baseline
+        for key in path:
+            current, previous = current.get(key, {}), previous.get(key, {})
+
+        if(not isinstance(previous, (int, float)) or previous == 0):
+            return ""
+
+        return f" ({(current - previous) / previous * 100:+.1f}%)"
+
+    lines = [
+        f"{results['series']} series in {results['elapsed_seconds']:.2f}s: {results['series_per_second']:.2f} series/s{change(['series_per_second'])}",
+        f"updated: {results['updated']}, failed: {results['failed']}"
+    ]
+
+    for name, stage in results["stages"].items():
+        lines.append(
+            f"  {name}: p50 {stage['p50_ms']:.1f} ms{change(['stages', name, 'p50_ms'])}, "
+            f"p99 {stage['p99_ms']:.1f} ms{change(['stages', name, 'p99_ms'])}"
+        )
+
+    lines.append(
+        f"peak RSS: {results['peak_rss_mb']['self']:.1f} MB{change(['peak_rss_mb', 'self'])}, "
+        f"cover processes: {results['peak_rss_mb']['children']:.1f} MB"
+    )
+
+    for error in results["errors"]:
+        lines.append(f"  error: {error}")
+
+    return "\n".join(lines)
+
+
+def main(argv:list[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    baseline = None
+    if(args.compare):
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = run(args)
+
+    print(report(results, baseline))
+
+    if(args.output):
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+    if(args.metrics):
+        with open(args.metrics, "w") as metrics_file:
+            metrics_file.write(MetricsRegistry.shared().to_prometheus())
+
+    return 1 if results["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+"""Local HTTP stand-ins for MangaDex, MangaUpdates and Komga, replaying the fixtures in benchmarks/fixtures.
+Only the endpoints used by providers/mangadex.py, providers/mangaupdates.py and komga/komga_connector.py are served.
+"""
+import copy
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlsplit, parse_qs
+
+from PIL import Image
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+@dataclass
+class StubOptions():
+    """Behavior injected into a stub server.
+
+    Attributes:
+        latency (float): Seconds added to every response.
+        jitter (float): Up to this many seconds added on top of latency, uniformly random.
+        rate_limit_probability (float): Probability of answering 429 instead of the response.
+        retry_after (float): "Retry-After" header of the 429 responses, in seconds.
+    """
+    latency: float = 0
+    jitter: float = 0
+    rate_limit_probability: float = 0
+    retry_after: float = 0.1
+
+
+class Library():
+    """Fake data shared by the stubs: series_count series named "Benchmark Series N",
+    each of them known by MangaDex and MangaUpdates under the same title.
+    """
+
+    def __init__(self, series_count:int = 200, summary_size:int = 500, cover_size:tuple[int, int] = (1000, 1500), seed:int = 0) -> None:
+        """
+        Args:
+            series_count (int, optional): Series in the Komga library. Defaults to 200.
+            summary_size (int, optional): Characters of the provider summaries, controls the JSON payload size. Defaults to 500.
+            cover_size (tuple[int, int], optional): Width and height of the served covers. Defaults to (1000, 1500).
+            seed (int, optional): Seed of the generated cover. Defaults to 0.
+        """
+        self.titles = [f"Benchmark Series {index}" for index in range(series_count)]
+        self.summary = ("Lorem ipsum dolor sit amet. " * (summary_size // 28 + 1))[:summary_size]
+        self.cover = Library.__generate_cover(cover_size, seed)
+
+        self.mangadex_ids = {title: str(uuid.uuid5(uuid.NAMESPACE_URL, title)) for title in self.titles}
+        self.mangadex_titles = {id_token: title for title, id_token in self.mangadex_ids.items()}
+
+        with open(os.path.join(FIXTURES_DIR, "mangadex_manga.json")) as fixture:
+            self.__mangadex_fixture = json.load(fixture)
+
+        with open(os.path.join(FIXTURES_DIR, "mangaupdates_series.json")) as fixture:
+            self.__mangaupdates_fixture = json.load(fixture)
+
+        with open(os.path.join(FIXTURES_DIR, "komga_series.json")) as fixture:
+            self.__komga_fixture = json.load(fixture)
+
+    def search(self, name:str) -> list[str]:
+        """Titles containing every word of name."""
+        words = name.casefold().split()
+
+        return [title for title in self.titles if all(word in title.casefold().split() for word in words)]
+
+    def mangadex_manga(self, id_token:str) -> dict:
+        title = self.mangadex_titles[id_token]
+        manga = copy.deepcopy(self.__mangadex_fixture)
+
+        manga["id"] = id_token
+        manga["attributes"]["title"]["en"] = title
+        manga["attributes"]["altTitles"][0]["ja"] = f"{title} (ja)"
+        manga["attributes"]["altTitles"][1]["ko"] = f"{title} (ko)"
+        manga["attributes"]["description"]["en"] = self.summary
+        manga["relationships"][0]["id"] = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{title} cover"))
+
+        return manga
+
+    def mangaupdates_series(self, series_id:int, base_url:str) -> dict:
+        title = self.titles[series_id]
+        series = copy.deepcopy(self.__mangaupdates_fixture)
+
+        series["series_id"] = series_id
+        series["title"] = title
+        series["associated"][0]["title"] = f"{title} (ja)"
+        series["associated"][1]["title"] = f"{title} (ko)"
+        series["description"] = self.summary
+        series["image"]["url"]["original"] = f"{base_url}/image/{series_id}.jpg"
+        series["image"]["url"]["thumb"] = f"{base_url}/image/thumb/{series_id}.jpg"
+
+        return series
+
+    def mangaupdates_record(self, series_id:int, base_url:str) -> dict:
+        """Search record of a series, a subset of the series fields as MangaUpdates returns."""
+        series = self.mangaupdates_series(series_id, base_url)
+
+        return {field: series[field] for field in ("series_id", "title", "description", "image", "type", "genres", "last_updated")}
+
+    def komga_series(self, index:int, library_id:str) -> dict:
+        title = self.titles[index]
+        series = copy.deepcopy(self.__komga_fixture)
+
+        series["id"] = f"series{index}"
+        series["libraryId"] = library_id
+        series["name"] = title
+        series["metadata"]["title"] = title
+        series["metadata"]["titleSort"] = title
+
+        return series
+
+    @staticmethod
+    def __generate_cover(size:tuple[int, int], seed:int) -> bytes:
+        # Noise does not compress, so the cover is about as heavy as a real scan of the same size.
+        noise = Image.frombytes("RGB", (size[0] // 4, size[1] // 4), random.Random(seed).randbytes(size[0] // 4 * size[1] // 4 * 3))
+
+        img_file = BytesIO()
+        noise.resize(size, Image.BILINEAR).save(img_file, "JPEG", quality=90)
+
+        return img_file.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Base handler, subclasses route requests in handle_request."""
+
+    protocol_version = "HTTP/1.1"
+    options = StubOptions()
+    library: Library = None
+
+    def do_GET(self) -> None:
+        self.__serve("GET")
+
+    def do_POST(self) -> None:
+        self.__serve("POST")
+
+    def do_PATCH(self) -> None:
+        self.__serve("PATCH")
+
+    def handle_request(self, method:str, path:str, query:dict, body:bytes):
+        """Returns:
+            tuple[int, object]: Status and body, dicts and lists are sent as JSON, bytes as a JPEG.
+        """
+        raise NotImplementedError
+
+    def log_message(self, format:str, *args) -> None:
+        pass
+
+    def __serve(self, method:str) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        time.sleep(self.options.latency + random.uniform(0, self.options.jitter))
+
+        if(random.random() < self.options.rate_limit_probability):
+            self.__send(429, {"result": "error", "errors": [{"status": 429, "title": "Too Many Requests"}]},
+                        {"Retry-After": str(self.options.retry_after)})
+            return
+
+        url = urlsplit(self.path)
+        status, response_body = self.handle_request(method, url.path, parse_qs(url.query), body)
+
+        self.__send(status, response_body)
+
+    def __send(self, status:int, body, headers:dict = None) -> None:
+        if(isinstance(body, bytes)):
+            content, content_type = body, "image/jpeg"
+
+        elif(body is None):
+            content, content_type = b"", None
+
+        else:
+            content, content_type = json.dumps(body).encode(), "application/json"
+
+        self.send_response(status)
+
+        if(content_type is not None):
+            self.send_header("Content-Type", content_type)
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class MangaDexHandler(StubHandler):
+    """GET /manga (search and ids[] batches), GET /manga/{id} and GET /covers/{id}/{filename}."""
+
+    def handle_request(self, method:str, path:str, query:dict, body:bytes):
+        if(path == "/manga"):
+            if("ids[]" in query):
+                id_tokens = [id_token for id_token in query["ids[]"] if id_token in self.library.mangadex_titles]
+
+            else:
+                id_tokens = [self.library.mangadex_ids[title] for title in self.library.search(query.get("title", [""])[0])]
+
+            limit = int(query.get("limit", [10])[0])
+            data = [self.library.mangadex_manga(id_token) for id_token in id_tokens[:limit]]
+
+            return 200, {"result": "ok", "response": "collection", "data": data, "limit": limit, "offset": 0, "total": len(id_tokens)}
+
+        match = re.fullmatch(r"/manga/([^/]+)", path)
+        if(match):
+            if(match.group(1) not in self.library.mangadex_titles):
+                return 404, {"result": "error", "errors": [{"status": 404}]}
+
+            return 200, {"result": "ok", "response": "entity", "data": self.library.mangadex_manga(match.group(1))}
+
+        if(path.startswith("/covers/")):
+            return 200, self.library.cover
+
+        return 404, {"result": "error", "errors": [{"status": 404}]}
+
+
+class MangaUpdatesHandler(StubHandler):
+    """POST /v1/series/search, GET /v1/series/{id} and GET /image/{id}.jpg."""
+
+    def handle_request(self, method:str, path:str, query:dict, body:bytes):
+        if(path == "/v1/series/search" and method == "POST"):
+            search = json.loads(body or b"{}")
+            titles = self.library.search(search.get("search", ""))[:search.get("perpage", 10)]
+            host = f"http://{self.headers['Host']}"
+            results = [
+                {"record": self.library.mangaupdates_record(self.library.titles.index(title), host), "hit_title": title} for title in titles
+            ]
+
+            return 200, {"total_hits": len(results), "page": 1, "per_page": len(results), "results": results}
+
+        match = re.fullmatch(r"/v1/series/(\d+)", path)
+        if(match and int(match.group(1)) < len(self.library.titles)):
+            return 200, self.library.mangaupdates_series(int(match.group(1)), f"http://{self.headers['Host']}")
+
+        if(path.startswith("/image/")):
+            return 200, self.library.cover
+
+        return 404, {"reason": "Not found"}
+
+
+class KomgaHandler(StubHandler):
+    """The endpoints of KomgaConnector: login, libraries, paged series, metadata PATCH and thumbnails."""
+
+    LIBRARY_ID = "benchmarklibrary"
+
+    def handle_request(self, method:str, path:str, query:dict, body:bytes):
+        if(path == "/api/v2/users/me"):
+            return 200, {"id": "benchmarkuser", "email": "benchmark@localhost", "roles": ["ADMIN"]}
+
+        if(path == "/api/v1/users/logout"):
+            return 204, None
+
+        if(path == "/api/v1/libraries"):
+            return 200, [{"id": KomgaHandler.LIBRARY_ID, "name": "Benchmark"}]
+
+        if(path == "/api/v1/series"):
+            page = int(query.get("page", [0])[0])
+            size = int(query.get("size", [20])[0])
+            indexes = range(page * size, min((page + 1) * size, len(self.library.titles)))
+
+            return 200, {
+                "content": [self.library.komga_series(index, KomgaHandler.LIBRARY_ID) for index in indexes],
+                "number": page,
+                "size": size,
+                "totalElements": len(self.library.titles),
+                "last": (page + 1) * size >= len(self.library.titles)
+            }
+
+        if(re.fullmatch(r"/api/v1/series/[^/]+/metadata", path) and method == "PATCH"):
+            return 204, None
+
+        if(re.fullmatch(r"/api/v1/series/[^/]+/thumbnails", path) and method == "POST"):
+            return 200, {"id": "thumbnail", "selected": True}
+
+        if(re.fullmatch(r"/api/v1/series/[^/]+/thumbnail", path)):
+            # No thumbnail yet, so every cover gets uploaded.
+            return 404, {"message": "Not found"}
+
+        return 404, {"message": "Not found"}
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients aborting a download (e.g. a cover over the size limit) are expected.
+        if(not isinstance(sys.exc_info()[1], ConnectionError)):
+            super().handle_error(request, client_address)
+
+
+class StubServer():
+    """One stub running on a background thread, usable as a context manager."""
+
+    def __init__(self, handler:type[StubHandler], library:Library, options:StubOptions = None, port:int = 0) -> None:
+        """
+        Args:
+            handler (type[StubHandler]): MangaDexHandler, MangaUpdatesHandler or KomgaHandler.
+            library (Library): Data served.
+            options (StubOptions, optional): Injected latency and 429s. Defaults to none.
+            port (int, optional): Port to listen on. Defaults to a free one.
+        """
+        handler_class = type(handler.__name__, (handler,), {"library": library, "options": options or StubOptions()})
+
+        self.server = _QuietServer(("127.0.0.1", port), handler_class)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -1,7 +1,37 @@
-__all__ = ["komga_connector", "komga_exceptions"]
+__all__ = ["komga_connector", "komga_exceptions", "async_komga_connector", "covers"]
 
-from .komga_connector import KomgaConnector
-from .komga_exceptions import KomgaBadRequest, KomgaExceptions, KomgaForbidden, KomgaLoginFailed, KomgaUnauthorized
+import importlib
 
-import sys
-sys.path.append("..")
\ No newline at end of file
+# Exported names and the submodule defining them, imported on first access (PEP 562)
+# so the sync connector does not load aiohttp and the exceptions do not load PIL.
+_EXPORTS = {
+    "KomgaConnector": "komga_connector",
+    "KomgaBadRequest": "komga_exceptions",
+    "KomgaExceptions": "komga_exceptions",
+    "KomgaForbidden": "komga_exceptions",
+    "KomgaLoginFailed": "komga_exceptions",
+    "KomgaUnauthorized": "komga_exceptions",
+    "KomgaUnavailable": "komga_exceptions",
+    "AsyncKomgaConnector": "async_komga_connector",
+    "encode_cover": "covers",
+    "encode_cover_data": "covers",
+    "is_uploadable": "covers",
+    "prepare_cover_data": "covers",
+    "perceptual_hash": "covers",
+    "hamming_distance": "covers"
+}
+
+
+def __getattr__(name:str):
+    if(name not in _EXPORTS):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    # Cached so later lookups skip __getattr__.
+    globals()[name] = value
+
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import time
+from concurrent.futures import Executor
+from .komga_connector import KomgaConnector
+from .covers import prepare_cover_data
+from .komga_exceptions import *
+from providers import MangaMetadata
+from providers.metrics import MetricsRegistry
+from providers.retry import RetryPolicy, CircuitBreaker, RetryLoop
+
+try:
+    import aiohttp
+except ImportError:
+    # Optional dependency, only needed by the async API.
+    aiohttp = None
+
+
+class AsyncKomgaConnector():
+    """Asyncio counterpart of KomgaConnector.
+    Uses the same configuration, patch body and cover preparation as KomgaConnector.
+    At most max_concurrency requests are in flight at once.
+
+    Usage:
+        async with AsyncKomgaConnector() as komga:
+            await komga.update_series_metadata(series_id, metadata)
+    """
+
+    def __init__(self, max_concurrency:int = 10, timeout:float = 60, cover_executor:Executor = None, retry_policy:RetryPolicy = None,
+                 circuit_breaker:CircuitBreaker = None) -> None:
+        """
+        Args:
+            max_concurrency (int, optional): Maximum requests in flight at once. Defaults to 10.
+            timeout (float, optional): Total timeout of one request in seconds. Defaults to 60.
+            cover_executor (Executor, optional): Executor encoding covers, e.g. a ProcessPoolExecutor. Defaults to the loop's default executor.
+            retry_policy (RetryPolicy, optional): Retries of server errors, timeouts and connection errors. Defaults to retrying every method but POST.
+            circuit_breaker (CircuitBreaker, optional): Breaker failing fast while Komga keeps failing. Defaults to CircuitBreaker.shared().
+        """
+        if(aiohttp is None):
+            raise ImportError("aiohttp is required for AsyncKomgaConnector. Install it with 'pip install aiohttp'.")
+
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.cover_executor = cover_executor
+        self.current_session = None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(methods=RetryPolicy.IDEMPOTENT_METHODS)
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker.shared()
+
+    async def __aenter__(self) -> "AsyncKomgaConnector":
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def login(self) -> None:
+        self.current_session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(KomgaConnector.KOMGA_USER, KomgaConnector.KOMGA_PASSWORD),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+        )
+
+        try:
+            status, _ = await self.__request("GET", "/api/v2/users/me")
+
+        except KomgaUnavailable:
+            await self.current_session.close()
+            raise
+
+        if(status >= 500):
+            await self.current_session.close()
+            raise KomgaUnavailable(f"Could not login, Komga answered ({status}).")
+
+        if(status != 200):
+            #Login failed; could not view API's user information.
+            await self.current_session.close()
+            raise KomgaLoginFailed("Could not login, incorrect credentials.")
+
+    async def close(self) -> None:
+        if(self.current_session is None):
+            return
+
+        try:
+            status, _ = await self.__request("GET", "/api/v1/users/logout")
+
+        finally:
+            # Komga being unreachable must not leak the session and its connections.
+            await self.current_session.close()
+            self.current_session = None
+
+        if(status != 204):
+            raise KomgaLoginFailed("Could not logout from session.")
+
+    async def get_all_series(self, library_id:str, limit:int = 100) -> list[dict]:
+        response = await self.__validated_request(
+            "GET",
+            "/api/v1/series",
+            params={"library_id": library_id,
+                    "size": limit}
+        )
+
+        return response["content"]
+
+    async def get_all_libraries(self) -> list[dict]:
+        return await self.__validated_request("GET", "/api/v1/libraries")
+
+    async def update_series_metadata(self, series_id:str, metadata: MangaMetadata, update_cover_art:bool = True, series:dict = None) -> list[str]:
+        """Patch the metadata of the series.
+        The cover is encoded in cover_executor so the event loop is not blocked,
+        use AsyncProvider.load_cover first so it is not downloaded on the loop either.
+        With series (as returned by get_all_series), only the changed fields are sent, see KomgaConnector.update_series_metadata.
+
+        Returns:
+            list[str]: Written fields of the patch body, and "cover" if the cover was uploaded.
+        """
+        patch_body = KomgaConnector.build_patch_body(metadata)
+
+        if(series is not None):
+            patch_body = KomgaConnector.changed_fields(patch_body, series)
+
+        written_fields = list(patch_body.keys())
+
+        if(patch_body):
+            await self.__validated_request(
+                "PATCH",
+                f"/api/v1/series/{series_id}/metadata",
+                json=patch_body
+            )
+
+        if(update_cover_art):
+            # Now updating the cover.
+            ready_to_upload_image = await asyncio.get_running_loop().run_in_executor(
+                self.cover_executor,
+                prepare_cover_data,
+                metadata.cover_art.data,
+                KomgaConnector.MAX_COVER_BYTES,
+                KomgaConnector.MAX_COVER_EDGE
+            )
+
+            form = aiohttp.FormData()
+            form.add_field("file", ready_to_upload_image, filename="cover.jpg", content_type="image/jpeg")
+
+            await self.__validated_request(
+                "POST",
+                f"/api/v1/series/{series_id}/thumbnails",
+                params={"selected": "true"},
+                data=form,
+                sent_bytes=len(ready_to_upload_image)
+            )
+
+            written_fields.append("cover")
+
+        return written_fields
+
+    async def __request(self, method:str, path:str, sent_bytes:int = None, **kwargs) -> tuple[int, bytes]:
+        """Send a request, server errors are returned once retry_policy gives up.
+        Raise KomgaUnavailable without sending it while the circuit of Komga is open,
+        or when it still times out or cannot connect after the retries.
+
+        Args:
+            sent_bytes (int, optional): Size of the request body recorded in the metrics, computed from "json" if not given.
+        """
+        url = f"{KomgaConnector.KOMGA_BASE_URL}{path}"
+        metrics = MetricsRegistry.shared()
+        loop = RetryLoop(method, url, "Komga", self.retry_policy, self.circuit_breaker)
+
+        if(sent_bytes is None):
+            sent_bytes = len(json.dumps(kwargs["json"])) if "json" in kwargs else 0
+
+        while(True):
+            if(not loop.allow()):
+                raise KomgaUnavailable(f"Too many consecutive failures, requests are paused. URL: {url}")
+
+            async with self.semaphore:
+                try:
+                    start = time.perf_counter()
+
+                    async with self.current_session.request(method, url, **kwargs) as api_response:
+                        status, headers, body = api_response.status, api_response.headers, await api_response.read()
+
+                    metrics.record_request("Komga", method, status, time.perf_counter() - start, len(body), sent_bytes)
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status, error = None, e
+
+            if(status is None):
+                delay = loop.on_error(True)
+
+                if(delay is None):
+                    raise KomgaUnavailable(f"{type(error).__name__} after {loop.attempt} retries. URL: {url}")
+
+                await asyncio.sleep(delay)
+                continue
+
+            delay = loop.on_response(status, headers)
+
+            if(delay is None):
+                return status, body
+
+            await asyncio.sleep(delay)
+
+    async def __validated_request(self, method:str, path:str, **kwargs):
+        status, body = await self.__request(method, path, **kwargs)
+        url = f"{KomgaConnector.KOMGA_BASE_URL}{path}"
+
+        if(status == 403):
+            #Forbidden response from the API.
+            raise KomgaForbidden(f"{json.loads(body)['message']}, URL: {url}")
+
+        if(status == 401):
+            #Unauthorized response from the API.
+            raise KomgaUnauthorized(f"{json.loads(body)['message']}, URL: {url}")
+
+        if(status == 400):
+            #BadRequest response from the API.
+            raise KomgaBadRequest(f"{json.loads(body)['violations']}, URL: {url}")
+
+        if(status == 200):
+            return json.loads(body) if body else None
+
+        if(status == 204):
+            return None
+
+        if(status >= 500):
+            #Server error that persisted through the retries.
+            raise KomgaUnavailable(f"Invalid response from Komga. {status}, URL: {url}")
+
+        raise KomgaExceptions(f"Invalid response from Komga. {status}, message: {body.decode(errors='replace')}")
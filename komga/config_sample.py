@@ -1,5 +1,9 @@
 KOMGA_CONFIG = {
     "base_URL": "", # e.g. http://komga.com or http://192.168.0.0:5000
     "user": "",
-    "password": ""
+    "password": "",
+    "max_cover_edge": None, # Optional, e.g. 1600 to downscale big covers before uploading.
+    "pool_maxsize": 10, # Optional, connections kept open to Komga.
+    "timeout": 60, # Optional, seconds before a request to Komga is abandoned and retried.
+    "session_file": None # Optional, e.g. "komga_session.json" to reuse the login across runs instead of logging in and out each time.
 }
\ No newline at end of file
@@ -0,0 +1,171 @@
+from io import BytesIO
+from typing import TYPE_CHECKING
+from providers.metrics import MetricsRegistry
+
+if TYPE_CHECKING:
+    # Imported by the functions themselves, so importing the connector does not load PIL.
+    from PIL import Image
+
+MAX_COVER_BYTES = 900000 # Komga thumbnails must not exceed 1MB.
+
+
+def encode_cover(image:"Image.Image", max_bytes:int = MAX_COVER_BYTES, max_edge:int = None, max_quality:int = 95, min_quality:int = 40) -> bytes:
+    """Encode the image as a JPEG smaller than max_bytes, with the highest quality that fits.
+    Quality is binary searched, so it costs a handful of encodes instead of one per quality step.
+    If even min_quality does not fit, the image is downscaled and searched again.
+
+    Args:
+        image (Image.Image): Cover art.
+        max_bytes (int, optional): Size limit of the JPEG. Defaults to MAX_COVER_BYTES.
+        max_edge (int, optional): Downscale so that the longest edge is at most max_edge pixels. Defaults to no limit.
+        max_quality (int, optional): Highest JPEG quality tried. Defaults to 95.
+        min_quality (int, optional): Lowest JPEG quality tried before downscaling. Defaults to 40.
+
+    Returns:
+        bytes: JPEG file.
+    """
+    with MetricsRegistry.shared().time("cover_encode_seconds"):
+        return _encode_within(image, max_bytes, max_edge, max_quality, min_quality)
+
+
+def _encode_within(image:"Image.Image", max_bytes:int, max_edge:int, max_quality:int, min_quality:int) -> bytes:
+    from PIL import Image
+
+    if(image.mode != "RGB"):
+        image = image.convert("RGB")
+
+    if(max_edge is not None and max(image.size) > max_edge):
+        image = image.copy()
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    while(True):
+        quality = _best_quality(image, max_bytes, min_quality, max_quality)
+
+        if(quality is not None):
+            # The search encodes without "optimize" as it is faster, optimizing only makes the file smaller.
+            return _encode(image, quality, optimize=True)
+
+        if(min(image.size) <= 16):
+            # Cannot get smaller in any meaningful way.
+            return _encode(image, min_quality, optimize=True)
+
+        image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)), Image.LANCZOS)
+
+
+def encode_cover_data(data:bytes, max_bytes:int = MAX_COVER_BYTES, max_edge:int = None) -> bytes:
+    """Decode an encoded cover and run encode_cover on it.
+    Takes and returns bytes so it can be submitted to a ProcessPoolExecutor.
+    With max_edge, JPEGs are decoded directly at a reduced size (at least max_edge), never at full resolution.
+    """
+    return encode_cover(decode_cover(data, max_edge), max_bytes=max_bytes, max_edge=max_edge)
+
+
+def decode_cover(data:bytes, max_edge:int = None) -> "Image.Image":
+    """Decode an encoded cover, JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale whose edges are still at least max_edge.
+    Decoding at a reduced scale is faster and needs a fraction of the memory of a full decode.
+    """
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+
+    if(max_edge is not None):
+        # Only JPEGs support it, the other formats are decoded fully.
+        image.draft("RGB", (max_edge, max_edge))
+
+    with MetricsRegistry.shared().time("cover_decode_seconds"):
+        image.load()
+
+    return image
+
+
+def is_uploadable(data:bytes, max_bytes:int = MAX_COVER_BYTES, max_edge:int = None) -> bool:
+    """Whether an encoded cover can be uploaded as is: an RGB or grayscale JPEG within max_bytes and max_edge.
+    Only the image header is read, nothing is decoded.
+    """
+    from PIL import Image
+
+    if(len(data) > max_bytes or not data.startswith(b"\xff\xd8\xff")):
+        return False
+
+    try:
+        image = Image.open(BytesIO(data))
+
+    except OSError:
+        return False
+
+    if(image.format != "JPEG" or image.mode not in ("RGB", "L")):
+        # CMYK JPEGs do not display in most browsers.
+        return False
+
+    return max_edge is None or max(image.size) <= max_edge
+
+
+def prepare_cover_data(data:bytes, max_bytes:int = MAX_COVER_BYTES, max_edge:int = None) -> bytes:
+    """The encoded cover itself if is_uploadable, otherwise encode_cover_data of it.
+    Covers that are already acceptable JPEGs skip a full decode and re-encode.
+    """
+    if(is_uploadable(data, max_bytes, max_edge)):
+        MetricsRegistry.shared().inc("cover_passthrough_total")
+        return data
+
+    return encode_cover_data(data, max_bytes, max_edge)
+
+
+def perceptual_hash(image:"Image.Image", hash_size:int = 8) -> int:
+    """Difference hash (dHash) of the image, similar images get hashes with a small hamming distance.
+    Robust to resizing and re-encoding, so a cover compares equal to the thumbnail Komga stored from it.
+
+    Returns:
+        int: hash_size * hash_size bits hash.
+    """
+    from PIL import Image
+
+    with MetricsRegistry.shared().time("cover_hash_seconds"):
+        pixels = list(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            bits = (bits << 1) | (left > right)
+
+    return bits
+
+
+def perceptual_hash_data(data:bytes, hash_size:int = 8) -> int:
+    """perceptual_hash of an encoded image, JPEGs are decoded at a reduced size as only a tiny version is needed."""
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    image.draft("L", (hash_size * 8, hash_size * 8))
+
+    return perceptual_hash(image, hash_size)
+
+
+def hamming_distance(first_hash:int, second_hash:int) -> int:
+    return bin(first_hash ^ second_hash).count("1")
+
+
+def _best_quality(image:"Image.Image", max_bytes:int, min_quality:int, max_quality:int) -> int:
+    """Highest quality in [min_quality, max_quality] whose JPEG fits in max_bytes, None if none does."""
+    best = None
+
+    while(min_quality <= max_quality):
+        quality = (min_quality + max_quality + 1) // 2
+
+        if(len(_encode(image, quality)) <= max_bytes):
+            best = quality
+            min_quality = quality + 1
+
+        else:
+            max_quality = quality - 1
+
+    return best
+
+
+def _encode(image:"Image.Image", quality:int, optimize:bool = False) -> bytes:
+    img_file = BytesIO()
+    image.save(img_file, "JPEG", quality=quality, optimize=optimize)
+
+    return img_file.getvalue()
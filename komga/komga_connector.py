@@ -1,28 +1,211 @@
+import json
+import os
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, Executor, Future
 from .config import KOMGA_CONFIG
 from .komga_exceptions import *
-from providers import MangaMetadata
+from .covers import encode_cover, is_uploadable, prepare_cover_data, perceptual_hash, perceptual_hash_data, hamming_distance, MAX_COVER_BYTES
+from providers import MangaMetadata, CoverArt
+from providers.metrics import MetricsRegistry
+from providers.retry import RetryPolicy, CircuitBreaker, RetryLoop
 from io import BytesIO
 
 class KomgaConnector():
+    """Client of the Komga API, safe to share between threads.
+    Use it as a context manager, or call close, so the session is saved or logged out.
+    Server errors, timeouts and connection errors are retried with backoff, and requests fail fast while Komga keeps failing.
+    """
     KOMGA_BASE_URL = KOMGA_CONFIG["base_URL"]
     KOMGA_USER = KOMGA_CONFIG["user"]
     KOMGA_PASSWORD = KOMGA_CONFIG["password"]
+    MAX_COVER_BYTES = MAX_COVER_BYTES
+    MAX_COVER_EDGE = KOMGA_CONFIG.get("max_cover_edge") # Covers are downscaled to this longest edge, None keeps the resolution.
+    COVER_HASH_THRESHOLD = 6 # Maximum hamming distance (of 64 bits) for two covers to be considered the same.
+    POOL_MAXSIZE = KOMGA_CONFIG.get("pool_maxsize", 10) # Connections kept open to Komga, should be at least the number of threads using the connector.
+    SESSION_FILE = KOMGA_CONFIG.get("session_file") # Optional, file where the session is saved and reused by later connectors and processes.
+    TIMEOUT = KOMGA_CONFIG.get("timeout", 60) # Seconds, or (connect, read) seconds, before a request is abandoned.
 
-    def __init__(self) -> None:
+    def __init__(self, session_file:str = None, pool_maxsize:int = None, timeout:float = None, retry_policy:RetryPolicy = None,
+                 circuit_breaker:CircuitBreaker = None) -> None:
+        """
+        Args:
+            session_file (str, optional): JSON file holding the session cookies. A saved session is reused without logging in,
+                and close saves it instead of logging out. Defaults to SESSION_FILE, None logs in and out every time.
+            pool_maxsize (int, optional): Connections kept open to Komga, threads beyond it wait for a free one. Defaults to POOL_MAXSIZE.
+            timeout (float | tuple[float, float], optional): Timeout of a request in seconds, or (connect, read) timeouts. Defaults to TIMEOUT.
+            retry_policy (RetryPolicy, optional): Retries of server errors, timeouts and connection errors.
+                Defaults to retrying every method but POST, so a thumbnail is never uploaded twice.
+            circuit_breaker (CircuitBreaker, optional): Breaker failing fast while Komga keeps failing. Defaults to CircuitBreaker.shared().
+
+        Raises:
+            KomgaLoginFailed: The credentials were refused.
+        """
+        self.session_file = session_file if session_file is not None else KomgaConnector.SESSION_FILE
+        self.timeout = timeout if timeout is not None else KomgaConnector.TIMEOUT
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(methods=RetryPolicy.IDEMPOTENT_METHODS)
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker.shared()
         self.current_session = requests.session()
         self.current_session.auth = (KomgaConnector.KOMGA_USER, KomgaConnector.KOMGA_PASSWORD)
+        self.current_session.hooks["response"].append(MetricsRegistry.shared().response_hook("Komga"))
+
+        # Every request goes to the same host, blocking keeps the pool at pool_maxsize instead of opening throwaway connections.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize or KomgaConnector.POOL_MAXSIZE, pool_block=True)
+        self.current_session.mount("http://", adapter)
+        self.current_session.mount("https://", adapter)
+
+        self.__session_lock = threading.Lock()
+
+        # Perceptual hash of the selected thumbnail of each series, saves downloading it again.
+        self.cover_hashes = {}
+
+        if(not self.__load_session()):
+            self.login()
+
+    def __enter__(self) -> "KomgaConnector":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
-        api_response = self.current_session.get(
-            url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v2/users/me"
+    def login(self) -> None:
+        """Authenticate with the configured credentials, then save the session if session_file is set.
+
+        Raises:
+            KomgaLoginFailed: The credentials were refused.
+        """
+        api_response = self.__request(
+            "GET",
+            url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v2/users/me",
+            # The remember-me cookie outlives the server side session, so a saved session stays usable longer.
+            params={"remember-me": "true"} if self.session_file else None
         )
 
+        if(api_response.status_code >= 500):
+            raise KomgaUnavailable(f"Could not login, Komga answered ({api_response.status_code}).")
+
         if(api_response.status_code != 200):
             #Login failed; could not view API's user information.
             raise KomgaLoginFailed("Could not login, incorrect credentials.")
+
+        self.__save_session()
+
+    def close(self) -> None:
+        """Save the session to session_file, or log out if there is none, and close the connections.
+        Calling it again does nothing, the connector cannot be used afterwards.
+
+        Raises:
+            KomgaLoginFailed: The logout was refused, the connections are closed anyway.
+        """
+        if(self.current_session is None):
+            return
+
+        try:
+            if(self.session_file):
+                # Not logged out, other connectors and processes keep using the session.
+                self.__save_session()
+
+            else:
+                api_response = self.__request(
+                    "GET",
+                    url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/users/logout"
+                )
+
+                if(api_response.status_code != 204):
+                    raise KomgaLoginFailed("Could not logout from session.")
+
+        finally:
+            self.current_session.close()
+            self.current_session = None
+
+    def __load_session(self) -> bool:
+        """Restore the cookies saved by __save_session.
+        The credentials are still sent, so an expired session is renewed by Komga on the next request instead of failing.
+
+        Returns:
+            bool: Whether a session of the same server and user was restored.
+        """
+        if(not self.session_file):
+            return False
+
+        try:
+            with open(self.session_file) as session_file:
+                saved = json.load(session_file)
+
+        except (OSError, ValueError):
+            return False
+
+        if(saved.get("base_URL") != KomgaConnector.KOMGA_BASE_URL or saved.get("user") != KomgaConnector.KOMGA_USER or not saved.get("cookies")):
+            return False
+
+        for cookie in saved["cookies"]:
+            self.current_session.cookies.set(**cookie)
+
+        return True
+
+    def __save_session(self) -> None:
+        """Write the session cookies to session_file, readable by the owner only.
+        Written to a temporary file then renamed, so concurrent processes never read a partial file.
+        """
+        if(not self.session_file):
+            return
+
+        saved = {
+            "base_URL": KomgaConnector.KOMGA_BASE_URL,
+            "user": KomgaConnector.KOMGA_USER,
+            "cookies": [
+                {"name": cookie.name, "value": cookie.value, "domain": cookie.domain, "path": cookie.path, "secure": cookie.secure, "expires": cookie.expires}
+                for cookie in self.current_session.cookies
+            ]
+        }
+
+        temporary_path = f"{self.session_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        with self.__session_lock:
+            with os.fdopen(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as session_file:
+                json.dump(saved, session_file)
+
+            os.replace(temporary_path, self.session_file)
+
+    def __request(self, method:str, url:str, **kwargs) -> requests.Response:
+        """Send a request, server errors are returned once retry_policy gives up and left to __validate_response.
+        Raise KomgaUnavailable without sending it while the circuit of Komga is open,
+        or when it still times out or cannot connect after the retries.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        loop = RetryLoop(method, url, "Komga", self.retry_policy, self.circuit_breaker)
+
+        while(True):
+            if(not loop.allow()):
+                raise KomgaUnavailable(f"Too many consecutive failures, requests are paused. URL: {url}")
+
+            try:
+                response = self.current_session.request(method, url, **kwargs)
+
+            except requests.RequestException as e:
+                delay = loop.on_error(isinstance(e, (requests.ConnectionError, requests.Timeout)))
+
+                if(delay is None):
+                    raise KomgaUnavailable(f"{type(e).__name__} after {loop.attempt} retries. URL: {url}")
+
+                time.sleep(delay)
+                continue
+
+            delay = loop.on_response(response.status_code, response.headers)
+
+            if(delay is None):
+                return response
+
+            response.close()
+            time.sleep(delay)
         
     def get_all_series(self, library_id:str, limit:int = 100) -> list[dict]:
-        api_response = self.current_session.get(
+        """Get the first page of series of the library, use iter_series to walk every page.
+        """
+        api_response = self.__request(
+            "GET",
             url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/series",
             params={"library_id": library_id,
                     "size": limit}
@@ -32,8 +215,77 @@ class KomgaConnector():
 
         return validated_response.json()["content"]
     
+    def iter_series(self, library_id:str, page_size:int = 100, prefetch:bool = True, params:dict = None, series_filter = None):
+        """Yield every series of the library, walking all pages.
+        Only one or two pages are held in memory at a time, so large libraries stream with flat memory.
+
+        Args:
+            library_id (str): Komga id of the library.
+            page_size (int, optional): Series requested per page. Defaults to 100.
+            prefetch (bool, optional): Request the next page while the current one is consumed. Defaults to True.
+            params (dict, optional): Extra query parameters for server-side filtering, e.g. {"search": "...", "status": "ONGOING"}.
+            series_filter (Callable[[dict], bool], optional): Client-side filter, e.g. KomgaConnector.missing_metadata.
+
+        Yields:
+            dict: Series as returned by Komga.
+        """
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        page_number = 0
+
+        try:
+            page = self.__get_series_page(library_id, page_number, page_size, params)
+
+            while(True):
+                next_page = None
+                if(executor is not None and not page["last"]):
+                    next_page = executor.submit(self.__get_series_page, library_id, page_number + 1, page_size, params)
+
+                for series in page["content"]:
+                    if(series_filter is None or series_filter(series)):
+                        yield series
+
+                if(page["last"]):
+                    break
+
+                page_number += 1
+                page = next_page.result() if next_page is not None else self.__get_series_page(library_id, page_number, page_size, params)
+
+        finally:
+            if(executor is not None):
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def missing_metadata(series:dict) -> bool:
+        """Series filter keeping series without summary, genres and tags.
+        """
+        if(series["metadata"]["summary"] != ""):
+            return False
+
+        if(series["metadata"]["genres"] != []):
+            return False
+
+        if(series["metadata"]["tags"] != []):
+            return False
+
+        return True
+
+    def __get_series_page(self, library_id:str, page_number:int, page_size:int, params:dict = None) -> dict:
+        api_response = self.__request(
+            "GET",
+            url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/series",
+            params={**(params or {}),
+                    "library_id": library_id,
+                    "page": page_number,
+                    "size": page_size}
+        )
+
+        validated_response = KomgaConnector.__validate_response(api_response)
+
+        return validated_response.json()
+
     def get_all_libraries(self) -> list[dict]:
-        api_response = self.current_session.get(
+        api_response = self.__request(
+            "GET",
             url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/libraries"
         )
 
@@ -41,10 +293,105 @@ class KomgaConnector():
 
         return validated_response.json()
     
-    def update_series_metadata(self, series_id:str, metadata: MangaMetadata, update_cover_art:bool = True) -> bool:
+    def update_series_metadata(self, series_id:str, metadata: MangaMetadata, update_cover_art:bool = True, cover:bytes = None,
+                               skip_unchanged_cover:bool = True, series:dict = None) -> list[str]:
         """Patch the metadata of the series.
+
+        Args:
+            series_id (str): Komga id of the series.
+            metadata (MangaMetadata): Metadata to apply.
+            update_cover_art (bool, optional): Upload the cover art too. Defaults to True.
+            cover (bytes, optional): Cover already prepared with submit_cover, otherwise it is prepared here.
+            skip_unchanged_cover (bool, optional): Do not upload a cover that looks the same as the selected thumbnail. Defaults to True.
+            series (dict, optional): The series as returned by get_all_series or iter_series.
+                Only the fields that differ from its current metadata are sent, no request is made if none does.
+
+        Returns:
+            list[str]: Written fields of the patch body, and "cover" if the cover was uploaded. Empty if nothing changed.
+        """
+
+        patch_body = KomgaConnector.build_patch_body(metadata)
+
+        if(series is not None):
+            patch_body = KomgaConnector.changed_fields(patch_body, series)
+
+        written_fields = list(patch_body.keys())
+
+        if(patch_body):
+            api_response = self.__request(
+                "PATCH",
+                url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/series/{series_id}/metadata",
+                json=patch_body,
+                
+            )
+
+            validated_response = KomgaConnector.__validate_response(api_response)
+
+        new_cover_hash = None
+        if(update_cover_art and skip_unchanged_cover):
+            if(cover is not None):
+                new_cover_hash = perceptual_hash_data(cover)
+
+            elif(isinstance(metadata.cover_art, CoverArt)):
+                # Hashed from the original bytes, JPEGs are decoded at a reduced size instead of fully.
+                new_cover_hash = perceptual_hash_data(metadata.cover_art.data)
+
+            else:
+                new_cover_hash = perceptual_hash(metadata.cover_art)
+
+            if(self.__is_same_cover(series_id, new_cover_hash)):
+                update_cover_art = False
+
+        if(update_cover_art):
+            # Now updating the cover.
+            ready_to_upload_image = BytesIO(cover) if cover is not None else KomgaConnector.prepare_cover(metadata)
+
+            api_response = self.__request(
+                "POST",
+                url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/series/{series_id}/thumbnails",
+                params={"selected": True},
+                files={
+                    "file": ready_to_upload_image.getvalue()
+                }
+            )
+
+            validated_response = KomgaConnector.__validate_response(api_response)
+
+            if(new_cover_hash is not None):
+                self.cover_hashes[series_id] = new_cover_hash
+
+            written_fields.append("cover")
+
+        return written_fields
+
+    def __is_same_cover(self, series_id:str, cover_hash:int) -> bool:
+        """Compare the cover with the selected thumbnail of the series using perceptual hashes.
         """
+        if(series_id not in self.cover_hashes):
+            api_response = self.__request(
+                "GET",
+                url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/series/{series_id}/thumbnail"
+            )
+
+            if(api_response.status_code != 200):
+                #No thumbnail to compare with.
+                return False
+
+            try:
+                self.cover_hashes[series_id] = perceptual_hash_data(api_response.content)
+
+            except OSError:
+                #Not a decodable image.
+                return False
+
+        return hamming_distance(self.cover_hashes[series_id], cover_hash) <= KomgaConnector.COVER_HASH_THRESHOLD
 
+
+
+    @staticmethod
+    def build_patch_body(metadata: MangaMetadata) -> dict:
+        """Convert the metadata to the body of "PATCH /api/v1/series/{id}/metadata".
+        """
         alt_title_komga_format_list = []
 
         for title in metadata.titles["alt_titles"]:
@@ -55,7 +402,7 @@ class KomgaConnector():
                 "title": value
             })
 
-        patch_body = {
+        return {
             "title": metadata.titles["main"],
             "summary": metadata.summary,
             "tags": metadata.tags,
@@ -63,31 +410,48 @@ class KomgaConnector():
             "alternateTitles": alt_title_komga_format_list
         }
 
-        api_response = self.current_session.patch(
-            url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/series/{series_id}/metadata",
-            json=patch_body,
-            
-        )
+    @staticmethod
+    def comparable_fields(fields:dict) -> dict:
+        """Normalize patch body fields the way Komga stores them, so stored and new values can be compared.
+        Komga lowercases tags and genres and keeps neither their order nor the order of alternate titles.
+        """
+        normalized = {}
 
-        validated_response = KomgaConnector.__validate_response(api_response)
+        for field, value in fields.items():
+            if(field in ("tags", "genres")):
+                value = sorted({item.casefold() for item in value or []})
 
-        if(update_cover_art):
-            # Now updating the cover.
-            ready_to_upload_image = KomgaConnector.__validate_cover(metadata)
+            elif(field == "alternateTitles"):
+                value = sorted({(title["label"], title["title"]) for title in value or []})
 
-            api_response = self.current_session.post(
-                url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/series/{series_id}/thumbnails",
-                params={"selected": True},
-                files={
-                    "file": ready_to_upload_image.getvalue()
-                }
-            )
+            normalized[field] = value
 
-            validated_response = KomgaConnector.__validate_response(api_response)
+        return normalized
 
-        return True
+    @staticmethod
+    def changed_fields(patch_body:dict, series:dict) -> dict:
+        """Only the fields of patch_body whose value differs from the current metadata of the series.
+
+        Args:
+            patch_body (dict): As returned by build_patch_body.
+            series (dict): The series as returned by get_all_series or iter_series.
+        """
+        current = dict(series["metadata"])
+        current["alternateTitles"] = [
+            {"label": title["label"], "title": title["title"]} for title in current.get("alternateTitles", [])
+        ]
 
+        new_values = KomgaConnector.comparable_fields(patch_body)
+        current_values = KomgaConnector.comparable_fields({field: current.get(field) for field in patch_body})
 
+        return {field: value for field, value in patch_body.items() if new_values[field] != current_values[field]}
+
+    @staticmethod
+    def prepare_cover(metadata: MangaMetadata) -> BytesIO:
+        """Encode the cover art as a JPEG that fits in Komga's thumbnail size limit.
+        Covers that already are such a JPEG are returned as downloaded, otherwise it is CPU bound, see submit_cover to run it in an executor.
+        """
+        return KomgaConnector.__validate_cover(metadata)
 
     @staticmethod
     def __validate_response(response:requests.Response) -> requests.Response:
@@ -105,32 +469,52 @@ class KomgaConnector():
         
         if(response.status_code == 200 or response.status_code == 204):
             return response
+
+        if(response.status_code >= 500):
+            #Server error that persisted through the retries.
+            raise KomgaUnavailable(f"Invalid response from Komga. {response.status_code}, URL: {response.url}")
         
         raise KomgaExceptions(f"Invalid response from Komga. {response.status_code}, message: {response.json()}")
     
     @staticmethod
     def __validate_cover(metadata: MangaMetadata) -> BytesIO:
-            img_file = BytesIO()
+            #Thumbnails must not exceed 1MB.
+            if(isinstance(metadata.cover_art, CoverArt)):
+                # Uploaded as downloaded when it is already an acceptable JPEG.
+                return BytesIO(prepare_cover_data(
+                    metadata.cover_art.data,
+                    max_bytes=KomgaConnector.MAX_COVER_BYTES,
+                    max_edge=KomgaConnector.MAX_COVER_EDGE
+                ))
 
-            #Checking file size, thumbnails must not exceed 1MB.
-            metadata.cover_art.save(img_file, 'JPEG', optimize = True)
+            return BytesIO(encode_cover(
+                metadata.cover_art,
+                max_bytes=KomgaConnector.MAX_COVER_BYTES,
+                max_edge=KomgaConnector.MAX_COVER_EDGE
+            ))
 
-            if(img_file.tell() > 900000):
-                #It exceed 1MB approx. . Hence, compress incrementally until it is less than 1 MB.
-                for quality in reversed(range(100)):
-                    img_file = BytesIO()
-                    metadata.cover_art.save(img_file, 'JPEG', optimize = True, quality=quality)
+    @staticmethod
+    def submit_cover(executor: Executor, metadata: MangaMetadata) -> Future:
+        """Prepare the cover in an executor, e.g. a ProcessPoolExecutor so a batch uses all cores.
+        The cover is downloaded on the calling thread, only its bytes are sent to the executor.
+        Covers that can be uploaded as downloaded are not sent to the executor at all.
 
-                    if(img_file.tell() < 900000):
-                        break
-                
-            return img_file
-    
-    def __del__(self):
-        api_response = self.current_session.get(
-            url=f"{KomgaConnector.KOMGA_BASE_URL}/api/v1/users/logout"
-        )
+        Returns:
+            Future: Resolves to the JPEG bytes, to be passed as "cover" to update_series_metadata.
+        """
+        data = metadata.cover_art.data
 
-        if(api_response.status_code != 204):
-            #Login failed; could not view API's user information.
-            raise KomgaLoginFailed("Could not logout from session.")
+        if(is_uploadable(data, KomgaConnector.MAX_COVER_BYTES, KomgaConnector.MAX_COVER_EDGE)):
+            MetricsRegistry.shared().inc("cover_passthrough_total")
+
+            future = Future()
+            future.set_result(data)
+
+            return future
+
+        return executor.submit(
+            prepare_cover_data,
+            data,
+            KomgaConnector.MAX_COVER_BYTES,
+            KomgaConnector.MAX_COVER_EDGE
+        )
@@ -25,4 +25,10 @@ class KomgaBadRequest(KomgaExceptions):
     """Raise when the API request is bad or missing some parameters"""
 
     def __init__(self, message) -> None:
-        super().__init__(message)
\ No newline at end of file
+        super().__init__(message)
+
+class KomgaUnavailable(KomgaExceptions):
+    """Raise when Komga keeps failing (5xx, timeouts, connection errors) or its circuit breaker is open"""
+
+    def __init__(self, message) -> None:
+        super().__init__(message)
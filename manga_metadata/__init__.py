@@ -0,0 +1,7 @@
+__all__ = ["pipeline", "match_policies", "title_matcher", "sync_state", "work_queue"]
+
+from .pipeline import SyncPipeline, SyncSummary, SyncItem
+from .match_policies import MATCH_POLICIES, normalize_title
+from .title_matcher import TitleMatcher, TitleMatch
+from .sync_state import SyncStateStore
+from .work_queue import WorkQueue, Lease
@@ -0,0 +1,197 @@
+import argparse
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from providers import MangaDex, MangaUpdates, CompositeProvider, MetricsRegistry, profiled
+from komga import KomgaConnector
+from .pipeline import SyncPipeline, SyncSummary
+from .match_policies import MATCH_POLICIES
+from .sync_state import SyncStateStore
+from .work_queue import WorkQueue
+
+PROVIDERS = {
+    "mangadex": MangaDex,
+    "mangaupdates": MangaUpdates
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m manga_metadata", description="Retrieve manga metadata and apply it to Komga.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Options of the commands selecting series.
+    selection = argparse.ArgumentParser(add_help=False)
+    selection.add_argument("--library", action="append", dest="libraries", help="Komga library id, can be repeated. Defaults to every library.")
+    selection.add_argument("--all-series", action="store_true", help="Also update series that already have metadata.")
+
+    # Options of the commands syncing series.
+    syncing = argparse.ArgumentParser(add_help=False)
+    syncing.add_argument("--provider", choices=list(PROVIDERS.keys()) + ["all"], default="mangadex", help="'all' queries every provider concurrently.")
+    syncing.add_argument("--strategy", choices=CompositeProvider.STRATEGIES, default="merge", help="How results are combined with '--provider all'.")
+    syncing.add_argument("--match", choices=MATCH_POLICIES.keys(), default="exact", help="How the search result to apply is chosen.")
+    syncing.add_argument("--search-workers", type=int, default=SyncPipeline.DEFAULT_WORKERS["search"])
+    syncing.add_argument("--fetch-workers", type=int, default=SyncPipeline.DEFAULT_WORKERS["fetch"])
+    syncing.add_argument("--upload-workers", type=int, default=SyncPipeline.DEFAULT_WORKERS["upload"])
+    syncing.add_argument("--max-candidates", type=int, default=5, help="Search results considered per series.")
+    syncing.add_argument("--no-cover", action="store_true", help="Do not upload cover art.")
+    syncing.add_argument("--dry-run", action="store_true", help="Match without writing to Komga.")
+
+    # Options of every command connecting to Komga.
+    connection = argparse.ArgumentParser(add_help=False)
+    connection.add_argument("--state", help="SQLite file remembering synced series, later runs only process new or changed ones and resume interrupted runs.")
+    connection.add_argument("--komga-session", help="File saving the Komga session, later runs reuse it instead of logging in again.")
+
+    # Options of the commands using the work queue.
+    queueing = argparse.ArgumentParser(add_help=False)
+    queueing.add_argument("--queue", required=True, help="SQLite file of the work queue, can be on a volume shared by several machines.")
+    queueing.add_argument("--no-wal", action="store_true", help="Use the rollback journal, required when the queue is on a network volume.")
+    queueing.add_argument("--lease-seconds", type=float, default=600, help="Seconds before a series leased by a worker that died is given to another one.")
+    queueing.add_argument("--max-attempts", type=int, default=3, help="Attempts before a series is marked failed.")
+    queueing.add_argument("--retry-delay", type=float, default=60, help="Seconds before a failed series is retried, doubled after every attempt.")
+
+    sync = commands.add_parser("sync", parents=[selection, syncing, connection], help="Sync metadata of Komga series without user interaction.")
+    sync.add_argument("--cover-processes", type=int, default=None, help="Processes encoding covers, 0 to encode on the upload threads. Defaults to the number of cores.")
+    sync.add_argument("--metrics", help="Write request and step metrics in the Prometheus text format to this file, '-' for stdout.")
+    sync.add_argument("--profile", help="Run under cProfile and save the stats to this file (readable with pstats or snakeviz).")
+
+    enqueue = commands.add_parser("enqueue", parents=[selection, connection, queueing], help="Add the series to sync to a work queue, drained by 'work'.")
+
+    work = commands.add_parser("work", parents=[syncing, connection, queueing], help="Sync the series of a work queue with several processes.")
+    work.add_argument("--processes", type=int, default=os.cpu_count(), help="Worker processes, each with its own provider and Komga clients. Defaults to the number of cores.")
+    work.add_argument("--cover-processes", type=int, default=0, help="Processes encoding covers per worker. Defaults to 0, the workers already use every core.")
+
+    commands.add_parser("queue-status", parents=[queueing], help="Count the series of a work queue per status and list the failed ones.")
+
+    return parser
+
+
+def build_pipeline(komga:KomgaConnector, args:argparse.Namespace, only_missing_metadata:bool = True) -> SyncPipeline:
+    if(args.provider == "all"):
+        provider = CompositeProvider(list(PROVIDERS.values()), strategy=args.strategy)
+
+    else:
+        provider = PROVIDERS[args.provider]
+
+    return SyncPipeline(
+        komga,
+        provider,
+        match_policy=args.match,
+        workers={"search": args.search_workers, "fetch": args.fetch_workers, "upload": args.upload_workers},
+        only_missing_metadata=only_missing_metadata,
+        update_cover_art=not args.no_cover,
+        max_candidates=args.max_candidates,
+        dry_run=args.dry_run,
+        cover_processes=args.cover_processes,
+        state=SyncStateStore(args.state) if args.state else None
+    )
+
+
+def connect(args:argparse.Namespace, upload_workers:int = 0) -> KomgaConnector:
+    # The upload workers and the page prefetch use the connector concurrently.
+    return KomgaConnector(session_file=args.komga_session, pool_maxsize=max(KomgaConnector.POOL_MAXSIZE, upload_workers + 2))
+
+
+def open_queue(args:argparse.Namespace) -> WorkQueue:
+    return WorkQueue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts, retry_delay=args.retry_delay, wal=not args.no_wal)
+
+
+def sync(args:argparse.Namespace) -> int:
+    with connect(args, args.upload_workers) as komga:
+        library_ids = args.libraries or [library["id"] for library in komga.get_all_libraries()]
+        pipeline = build_pipeline(komga, args, only_missing_metadata=not args.all_series)
+
+        with profiled(args.profile) if args.profile else nullcontext():
+            summary = pipeline.run(library_ids)
+
+        for error in summary.errors:
+            print(error, file=sys.stderr)
+
+        print(summary)
+
+        if(args.metrics == "-"):
+            print(MetricsRegistry.shared().to_prometheus())
+
+        elif(args.metrics):
+            with open(args.metrics, "w") as metrics_file:
+                metrics_file.write(MetricsRegistry.shared().to_prometheus())
+
+        return 1 if summary.failed else 0
+
+
+def enqueue(args:argparse.Namespace) -> int:
+    work_queue = open_queue(args)
+
+    with connect(args) as komga:
+        library_ids = args.libraries or [library["id"] for library in komga.get_all_libraries()]
+        # Only enumerates and filters, no provider is used.
+        pipeline = SyncPipeline(komga, None, only_missing_metadata=not args.all_series, state=SyncStateStore(args.state) if args.state else None)
+        summary = pipeline.enqueue(library_ids, work_queue)
+
+    print(f"Enumerated: {summary.enumerated} series, queued: {summary.selected}, unchanged since last run: {summary.skipped_unchanged}")
+    print(f"Queue: {work_queue.counts()}")
+    work_queue.close()
+
+    return 0
+
+
+def work_process(args:argparse.Namespace) -> SyncSummary:
+    """One worker process, draining the queue with its own provider and Komga clients."""
+    work_queue = open_queue(args)
+
+    with connect(args, args.upload_workers) as komga:
+        summary = build_pipeline(komga, args).run_queue(work_queue)
+
+    work_queue.close()
+
+    return summary
+
+
+def work(args:argparse.Namespace) -> int:
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = [executor.submit(work_process, args) for _ in range(args.processes)]
+
+        for index, future in enumerate(futures):
+            summary = future.result()
+
+            for error in summary.errors:
+                print(error, file=sys.stderr)
+
+            print(f"Worker {index}:\n{summary}")
+
+    return queue_status(args)
+
+
+def queue_status(args:argparse.Namespace) -> int:
+    work_queue = open_queue(args)
+    counts = work_queue.counts()
+
+    print(f"Queue: {counts}")
+    for title, error in work_queue.errors():
+        print(f"  failed '{title}': {error}")
+
+    work_queue.close()
+
+    return 1 if counts[WorkQueue.FAILED] else 0
+
+
+def main(argv:list[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    if(args.command == "sync"):
+        return sync(args)
+
+    if(args.command == "enqueue"):
+        return enqueue(args)
+
+    if(args.command == "work"):
+        return work(args)
+
+    if(args.command == "queue-status"):
+        return queue_status(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+from .title_matcher import TitleMatcher
+
+FUZZY_MIN_CONFIDENCE = 0.85
+
+# Policies pick among candidates by their titles: SearchCandidate or MangaMetadata, anything with "titles" as returned by get_titles.
+# Provider.select_candidate then promotes only the chosen one.
+
+
+def normalize_title(title:str) -> str:
+    """Casefold and keep only letters and digits, so "I'm A Tycoon" and "im a tycoon!" compare equal."""
+    return TitleMatcher.normalize(title).replace(" ", "")
+
+
+def first_match(komga_title:str, candidates:list):
+    """Take the most relevant search result, as ordered by the provider."""
+    return candidates[0] if candidates else None
+
+
+def exact_match(komga_title:str, candidates:list):
+    """Take the first search result with a main or alt title equal to the Komga title, ignoring case and punctuation."""
+    normalized = normalize_title(komga_title)
+
+    for candidate in candidates:
+        if(normalized in [normalize_title(title) for title in TitleMatcher.all_titles(candidate.titles)]):
+            return candidate
+
+    return None
+
+
+def fuzzy_match(komga_title:str, candidates:list):
+    """Take the candidate whose main or alt titles are the most similar to the Komga title,
+    if its confidence is at least FUZZY_MIN_CONFIDENCE.
+    """
+    # Candidates differ for every series, so the index only holds this search's few titles.
+    matcher = TitleMatcher()
+    for index, candidate in enumerate(candidates):
+        matcher.add(index, candidate.titles)
+
+    matches = matcher.match(komga_title, limit=1, min_confidence=FUZZY_MIN_CONFIDENCE)
+
+    return candidates[matches[0].key] if matches else None
+
+
+MATCH_POLICIES = {
+    "first": first_match,
+    "exact": exact_match,
+    "fuzzy": fuzzy_match
+}
@@ -0,0 +1,409 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from providers import MangaMetadata, SearchCandidate, CompositeProvider, MetricsRegistry
+from komga import KomgaConnector
+from .match_policies import MATCH_POLICIES
+from .sync_state import SyncStateStore
+from .work_queue import WorkQueue
+
+
+@dataclass
+class SyncItem():
+    """One Komga series travelling through the pipeline."""
+    series: dict
+    candidates: list[SearchCandidate] = None
+    metadata: MangaMetadata = None
+    cover: Future = None
+
+    @property
+    def title(self) -> str:
+        return self.series["metadata"]["title"]
+
+
+@dataclass
+class StageStats():
+    processed: int = 0
+    failed: int = 0
+    busy_seconds: float = 0
+    durations: list[float] = field(default_factory=list)
+
+    def percentile(self, percent:float) -> float:
+        """Duration in seconds under which `percent` % of the processed series took, 0 if none."""
+        if(not self.durations):
+            return 0
+
+        durations = sorted(self.durations)
+
+        return durations[min(len(durations) - 1, int(len(durations) * percent / 100))]
+
+
+@dataclass
+class SyncSummary():
+    enumerated: int = 0
+    selected: int = 0
+    not_found: int = 0
+    unmatched: int = 0
+    matched: int = 0 # Dry runs only, matches that would have been uploaded.
+    updated: int = 0
+    up_to_date: int = 0
+    skipped_unchanged: int = 0
+    failed: int = 0
+    elapsed_seconds: float = 0
+    stages: dict[str, StageStats] = field(default_factory=dict)
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def series_per_second(self) -> float:
+        return self.enumerated / self.elapsed_seconds if self.elapsed_seconds else 0
+
+    def __str__(self) -> str:
+        lines = [
+            f"Enumerated: {self.enumerated} series in {self.elapsed_seconds:.1f}s ({self.series_per_second:.2f} series/s)",
+            f"Selected: {self.selected}, unchanged since last run: {self.skipped_unchanged}, updated: {self.updated}, already up to date: {self.up_to_date}, "
+            f"no search results: {self.not_found}, "
+            f"no accepted match: {self.unmatched}, failed: {self.failed}"
+        ]
+
+        if(self.matched):
+            lines.append(f"Dry run, matched without uploading: {self.matched}")
+
+        for name, stats in self.stages.items():
+            lines.append(
+                f"  {name}: {stats.processed} processed, {stats.failed} failed, "
+                f"p50 {stats.percentile(50) * 1000:.0f} ms, p99 {stats.percentile(99) * 1000:.0f} ms"
+            )
+
+        return "\n".join(lines)
+
+
+class _Done():
+    """Queue sentinel marking the end of a stage's input."""
+
+
+class SyncPipeline():
+    """Headless, staged metadata sync: enumerate -> filter -> search -> fetch -> upload.
+    Every stage has its own pool of worker threads connected by bounded queues,
+    so searching, fetching and uploading of different series overlap.
+    """
+
+    DEFAULT_WORKERS = {"search": 4, "fetch": 4, "upload": 2}
+
+    def __init__(self, komga:KomgaConnector, provider, match_policy:str = "exact", workers:dict[str, int] = None,
+                 only_missing_metadata:bool = True, update_cover_art:bool = True, max_candidates:int = 5, dry_run:bool = False,
+                 cover_processes:int = None, state:SyncStateStore = None) -> None:
+        """
+        Args:
+            komga (KomgaConnector): Logged in Komga connection.
+            provider (Provider): Provider class used for searching and fetching, e.g. MangaDex, or a CompositeProvider instance.
+            match_policy (str, optional): Name of a policy in MATCH_POLICIES picking the candidate to apply. Defaults to "exact".
+            workers (dict[str, int], optional): Worker threads per stage, merged over DEFAULT_WORKERS.
+            only_missing_metadata (bool, optional): Skip series that already have a summary, genres or tags. Defaults to True.
+            update_cover_art (bool, optional): Upload the cover art too. Defaults to True.
+            max_candidates (int, optional): Search results offered to the match policy, only the chosen one is fetched. Defaults to 5.
+            dry_run (bool, optional): Match without uploading anything to Komga. Defaults to False.
+            cover_processes (int, optional): Processes encoding covers, 0 encodes on the upload threads. Defaults to the number of cores.
+            state (SyncStateStore, optional): Skip series unchanged since the last run and checkpoint every processed series.
+        """
+        self.komga = komga
+        self.provider = provider
+        self.match_policy = MATCH_POLICIES[match_policy]
+        self.workers = {**SyncPipeline.DEFAULT_WORKERS, **(workers or {})}
+        self.only_missing_metadata = only_missing_metadata
+        self.update_cover_art = update_cover_art
+        self.max_candidates = max_candidates
+        self.dry_run = dry_run
+        self.cover_processes = cover_processes
+        self.cover_executor = None
+        self.state = state
+
+        self.work_queue = None
+        self.owner = None
+
+        self.summary = SyncSummary()
+        self.__lock = threading.Lock()
+        # Ids of the leased series in the pipeline, see __heartbeat.
+        self.__leased = set()
+
+    def run(self, library_ids:list[str]) -> SyncSummary:
+        """Sync every series of the libraries and return the summary of the run.
+        """
+        return self.__run(self.__select(library_ids))
+
+    def enqueue(self, library_ids:list[str], work_queue:WorkQueue, batch_size:int = 500) -> SyncSummary:
+        """Enumerate and filter the series of the libraries like run, but add them to work_queue instead of syncing them.
+        Workers then drain the queue with run_queue, from any number of processes or machines.
+
+        Returns:
+            SyncSummary: enumerated, selected and skipped_unchanged of the run, selected is the number of series queued.
+        """
+        self.summary = SyncSummary()
+        start = time.perf_counter()
+
+        for library_id in library_ids:
+            series_list = self.__select([library_id])
+
+            # Committed in batches, so a large library is not held in memory at once.
+            while(batch := list(itertools.islice(series_list, batch_size))):
+                work_queue.enqueue(batch, library_id)
+
+        self.summary.elapsed_seconds = time.perf_counter() - start
+
+        return self.summary
+
+    def run_queue(self, work_queue:WorkQueue, owner:str = None, poll_interval:float = 1) -> SyncSummary:
+        """Sync the series of work_queue until none is left, then return the summary of this worker.
+        Series are leased a few at a time, completed once they left the pipeline and given back for a retry when a stage failed.
+        The leases of the series in the pipeline are renewed every third of the queue's lease_seconds.
+
+        Args:
+            work_queue (WorkQueue): Queue filled with enqueue, the filters were applied when queueing.
+            owner (str, optional): Name of this worker in the queue. Defaults to WorkQueue.default_owner().
+            poll_interval (float, optional): Seconds between two lease attempts while the remaining series are leased by
+                other workers or waiting for a retry. Defaults to 1.
+        """
+        self.work_queue = work_queue
+        self.owner = owner or WorkQueue.default_owner()
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self.__heartbeat, args=(stop_heartbeat,), name="lease-heartbeat", daemon=True)
+        heartbeat.start()
+
+        try:
+            return self.__run(self.__lease(poll_interval))
+
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+            self.work_queue = None
+
+    def __run(self, series_list) -> SyncSummary:
+        self.summary = SyncSummary()
+        start = time.perf_counter()
+
+        stages = [
+            ("search", self.__search),
+            ("fetch", self.__fetch),
+            ("upload", self.__upload)
+        ]
+        queues = [queue.Queue(maxsize=self.workers[name] * 4) for name, _ in stages] + [None]
+
+        if(self.update_cover_art and not self.dry_run and self.cover_processes != 0):
+            self.cover_executor = ProcessPoolExecutor(max_workers=self.cover_processes)
+
+        threads = []
+        for (name, function), inbox, outbox in zip(stages, queues, queues[1:]):
+            self.summary.stages[name] = StageStats()
+            threads.append(self.__start_stage(name, function, inbox, outbox))
+
+        # Enumerate and filter (or lease) on the calling thread, feeding the first stage.
+        try:
+            for series in series_list:
+                queues[0].put(SyncItem(series))
+
+        finally:
+            # Also when enumerating raised: the queued series are finished and the cover processes stopped.
+            queues[0].put(_Done())
+
+            try:
+                for thread in threads:
+                    thread.join()
+
+            finally:
+                if(self.cover_executor is not None):
+                    self.cover_executor.shutdown()
+                    self.cover_executor = None
+
+        self.summary.elapsed_seconds = time.perf_counter() - start
+
+        return self.summary
+
+    def __select(self, library_ids:list[str]):
+        """Yield the series of the libraries that need to be synced."""
+        for library_id in library_ids:
+            for series in self.komga.iter_series(library_id):
+                self.summary.enumerated += 1
+
+                if(self.only_missing_metadata and not KomgaConnector.missing_metadata(series)):
+                    continue
+
+                if(self.state is not None and not self.state.should_process(series)):
+                    self.summary.skipped_unchanged += 1
+                    continue
+
+                self.summary.selected += 1
+                yield series
+
+    def __lease(self, poll_interval:float):
+        """Yield the series leased from the work queue until it is drained."""
+        while(True):
+            leases = self.work_queue.lease(self.owner, self.workers["search"])
+
+            if(not leases):
+                if(self.work_queue.remaining() == 0):
+                    return
+
+                # Leased series (ours included) may be given back for a retry, or expire if their worker died.
+                time.sleep(poll_interval)
+                continue
+
+            for lease in leases:
+                self.summary.enumerated += 1
+                self.summary.selected += 1
+
+                with self.__lock:
+                    self.__leased.add(lease.series["id"])
+
+                yield lease.series
+
+    def __heartbeat(self, stop:threading.Event) -> None:
+        """Extend the leases of the series in the pipeline until stop is set,
+        they may wait in the stage queues or take longer than lease_seconds to process.
+        """
+        while(not stop.wait(self.work_queue.lease_seconds / 3)):
+            with self.__lock:
+                series_ids = list(self.__leased)
+
+            if(series_ids):
+                self.work_queue.extend(series_ids, self.owner)
+
+    def __search(self, item:SyncItem) -> SyncItem:
+        if(isinstance(self.provider, CompositeProvider)):
+            # Searches and fetches every provider concurrently, the fetch stage only forwards the item.
+            item.metadata = self.provider.find_metadata(item.title, self.match_policy, self.max_candidates)
+
+            if(item.metadata is None):
+                self.__count("unmatched")
+                self.__checkpoint(item, SyncStateStore.UNMATCHED)
+                return None
+
+            return item
+
+        # Complete candidates (e.g. MangaDex search results) are promoted without another request in the fetch stage.
+        item.candidates = self.provider.search_candidates(item.title)[:self.max_candidates]
+
+        if(not item.candidates):
+            self.__count("not_found")
+            self.__checkpoint(item, SyncStateStore.NOT_FOUND)
+            return None
+
+        return item
+
+    def __fetch(self, item:SyncItem) -> SyncItem:
+        if(item.metadata is None):
+            item.metadata = self.provider.select_candidate(item.title, item.candidates, self.match_policy)
+
+            if(item.metadata is None):
+                self.__count("unmatched")
+                self.__checkpoint(item, SyncStateStore.UNMATCHED)
+                return None
+
+        if(self.cover_executor is not None):
+            # Encoded by the process pool while the item waits for an upload worker.
+            item.cover = KomgaConnector.submit_cover(self.cover_executor, item.metadata)
+
+        return item
+
+    def __upload(self, item:SyncItem) -> SyncItem:
+        if(self.dry_run):
+            # Nothing is written, the match is only counted.
+            self.__count("matched")
+            return item
+
+        written_fields = self.komga.update_series_metadata(
+            item.series["id"],
+            item.metadata,
+            update_cover_art=self.update_cover_art,
+            cover=item.cover.result() if item.cover is not None else None,
+            series=item.series
+        )
+
+        # Nothing written when Komga already had the same metadata and cover.
+        self.__count("updated" if written_fields != [] else "up_to_date")
+        self.__checkpoint(item, SyncStateStore.UPDATED)
+
+        return item
+
+    def __start_stage(self, name:str, function, inbox:queue.Queue, outbox:queue.Queue) -> threading.Thread:
+        """Start the worker threads of a stage, the returned thread finishes once all of them did."""
+        stats = self.summary.stages[name]
+
+        def work() -> None:
+            while(True):
+                item = inbox.get()
+
+                if(isinstance(item, _Done)):
+                    # Let the sibling workers see it too.
+                    inbox.put(item)
+                    return
+
+                start = time.perf_counter()
+                error = None
+                try:
+                    result = function(item)
+
+                except Exception as e:
+                    # One bad series must not stop an unattended run.
+                    result = None
+                    error = f"{name} '{item.title}': {e}"
+                    with self.__lock:
+                        stats.failed += 1
+                        self.summary.failed += 1
+                        self.summary.errors.append(error)
+
+                duration = time.perf_counter() - start
+                with self.__lock:
+                    stats.processed += 1
+                    stats.busy_seconds += duration
+                    stats.durations.append(duration)
+
+                MetricsRegistry.shared().observe("pipeline_stage_seconds", duration, stage=name)
+
+                if(result is not None and outbox is not None):
+                    outbox.put(result)
+
+                else:
+                    # The series left the pipeline, done or failed.
+                    self.__release(item, error)
+
+        workers = [threading.Thread(target=work, name=f"{name}-{index}", daemon=True) for index in range(self.workers[name])]
+
+        def supervise() -> None:
+            for worker in workers:
+                worker.start()
+
+            for worker in workers:
+                worker.join()
+
+            if(outbox is not None):
+                outbox.put(_Done())
+
+        supervisor = threading.Thread(target=supervise, name=f"{name}-supervisor", daemon=True)
+        supervisor.start()
+
+        return supervisor
+
+    def __release(self, item:SyncItem, error:str = None) -> None:
+        """Report the outcome of a leased series to the work queue."""
+        if(self.work_queue is None):
+            return
+
+        with self.__lock:
+            self.__leased.discard(item.series["id"])
+
+        if(error is None):
+            self.work_queue.complete(item.series["id"], self.owner)
+
+        else:
+            self.work_queue.fail(item.series["id"], self.owner, error)
+
+    def __checkpoint(self, item:SyncItem, status:str) -> None:
+        if(self.state is not None and not self.dry_run):
+            self.state.record(item.series, status, item.metadata)
+
+    def __count(self, counter:str) -> None:
+        with self.__lock:
+            setattr(self.summary, counter, getattr(self.summary, counter) + 1)
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from providers import MangaMetadata
+from komga import KomgaConnector
+
+
+class SyncStateStore():
+    """Persisted per-series sync state, so later runs only process new or changed Komga series
+    and an interrupted run resumes where it stopped (every series is checkpointed as soon as it is done).
+    """
+
+    UPDATED = "updated"
+    NOT_FOUND = "not_found"
+    UNMATCHED = "unmatched"
+
+    def __init__(self, path:str, retry_unmatched_after:float = 7 * 86400) -> None:
+        """
+        Args:
+            path (str): SQLite database file, created if it does not exist.
+            retry_unmatched_after (float, optional): Seconds before series without a match are searched again. Defaults to 7 days.
+        """
+        self.path = path
+        self.retry_unmatched_after = retry_unmatched_after
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+
+        with self.__connection:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute(
+                """CREATE TABLE IF NOT EXISTS series_state (
+                    series_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    provider TEXT,
+                    id_token TEXT,
+                    metadata_hash TEXT,
+                    komga_last_modified TEXT,
+                    synced_at REAL NOT NULL
+                )"""
+            )
+
+    def should_process(self, series:dict) -> bool:
+        """Whether the series is new or changed since it was last recorded.
+        Changes made by our own update (same metadata hash) do not count.
+        """
+        row = self.get(series["id"])
+
+        if(row is None):
+            return True
+
+        if(row["status"] != SyncStateStore.UPDATED):
+            return time.time() - row["synced_at"] > self.retry_unmatched_after or row["komga_last_modified"] != series.get("lastModified")
+
+        if(row["komga_last_modified"] == series.get("lastModified")):
+            return False
+
+        if(row["metadata_hash"] == SyncStateStore.komga_metadata_hash(series)):
+            # Only modified by our own update, remember the new modification time.
+            self.__update_last_modified(series["id"], series.get("lastModified"))
+            return False
+
+        return True
+
+    def record(self, series:dict, status:str, metadata:MangaMetadata = None) -> None:
+        """Checkpoint the outcome of one series."""
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO series_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    series["id"],
+                    status,
+                    metadata.provider if metadata is not None else None,
+                    metadata.id_token if metadata is not None else None,
+                    SyncStateStore.metadata_hash(metadata) if metadata is not None else None,
+                    series.get("lastModified"),
+                    time.time()
+                )
+            )
+
+    def get(self, series_id:str) -> dict:
+        with self.__lock:
+            cursor = self.__connection.execute("SELECT * FROM series_state WHERE series_id = ?", (series_id,))
+            row = cursor.fetchone()
+
+        if(row is None):
+            return None
+
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def forget(self, series_id:str) -> None:
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM series_state WHERE series_id = ?", (series_id,))
+
+    def close(self) -> None:
+        self.__connection.close()
+
+    @staticmethod
+    def metadata_hash(metadata:MangaMetadata) -> str:
+        """Hash of the fields written to Komga for the metadata."""
+        return SyncStateStore.__hash_fields(KomgaConnector.build_patch_body(metadata))
+
+    @staticmethod
+    def komga_metadata_hash(series:dict) -> str:
+        """Hash of the same fields as metadata_hash, read from a Komga series."""
+        return SyncStateStore.__hash_fields({
+            "title": series["metadata"]["title"],
+            "summary": series["metadata"]["summary"],
+            "tags": series["metadata"]["tags"],
+            "genres": series["metadata"]["genres"],
+            "alternateTitles": [
+                {"label": title["label"], "title": title["title"]} for title in series["metadata"].get("alternateTitles", [])
+            ]
+        })
+
+    @staticmethod
+    def __hash_fields(fields:dict) -> str:
+        normalized = KomgaConnector.comparable_fields(fields)
+
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+    def __update_last_modified(self, series_id:str, last_modified:str) -> None:
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "UPDATE series_state SET komga_last_modified = ? WHERE series_id = ?", (last_modified, series_id)
+            )
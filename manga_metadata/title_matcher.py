@@ -0,0 +1,139 @@
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from providers import MangaMetadata
+
+
+@dataclass
+class TitleMatch():
+    key: object
+    title: str
+    confidence: float
+
+
+class TitleMatcher():
+    """Fuzzy matcher of titles against an index of candidate titles.
+    Every main and alt title of a candidate is indexed by character n-grams, so scoring a query only
+    touches the candidates sharing n-grams with it instead of every candidate, and a whole library can be
+    scored against all candidates at once with match_many.
+
+    Confidence is a blend of the n-gram Dice coefficient and the word overlap, 1 for titles equal
+    after normalization.
+    """
+
+    def __init__(self, n:int = 3, ngram_weight:float = 0.7) -> None:
+        """
+        Args:
+            n (int, optional): Length of the character n-grams. Defaults to 3.
+            ngram_weight (float, optional): Weight of the n-gram similarity, the rest goes to word overlap. Defaults to 0.7.
+        """
+        self.n = n
+        self.ngram_weight = ngram_weight
+
+        # One entry per indexed title: (key, original title, normalized title, n-grams, words)
+        self.__entries = []
+        self.__index = defaultdict(list)
+
+    def add(self, key, titles:dict) -> None:
+        """Index every title of a candidate.
+
+        Args:
+            key (object): Returned in matches to identify the candidate, e.g. its id_token.
+            titles (dict): Titles as returned by the providers' get_titles.
+        """
+        for title in TitleMatcher.all_titles(titles):
+            normalized = TitleMatcher.normalize(title)
+
+            if(not normalized):
+                continue
+
+            ngrams = self.__ngrams(normalized)
+            self.__entries.append((key, title, normalized, ngrams, set(normalized.split())))
+
+            for ngram in ngrams:
+                self.__index[ngram].append(len(self.__entries) - 1)
+
+    def add_metadata(self, metadata:MangaMetadata) -> None:
+        """Index a candidate's titles, keyed by its id_token."""
+        self.add(metadata.id_token, metadata.titles)
+
+    def match(self, title:str, limit:int = 5, min_confidence:float = 0) -> list[TitleMatch]:
+        """Rank the indexed candidates against title.
+
+        Args:
+            title (str): Title to match, e.g. the Komga series title.
+            limit (int, optional): Maximum matches returned. Defaults to 5.
+            min_confidence (float, optional): Matches below this confidence are dropped. Defaults to 0.
+
+        Returns:
+            list[TitleMatch]: Best match of every candidate key, highest confidence first.
+        """
+        normalized = TitleMatcher.normalize(title)
+
+        if(not normalized):
+            return []
+
+        ngrams = self.__ngrams(normalized)
+        words = set(normalized.split())
+
+        # Number of n-grams shared with each entry, entries sharing none are never looked at.
+        shared = Counter()
+        for ngram in ngrams:
+            shared.update(self.__index.get(ngram, ()))
+
+        best = {}
+        for entry_index, shared_count in shared.items():
+            key, entry_title, entry_normalized, entry_ngrams, entry_words = self.__entries[entry_index]
+
+            if(entry_normalized == normalized):
+                confidence = 1.0
+
+            else:
+                ngram_score = 2 * shared_count / (len(ngrams) + len(entry_ngrams))
+                word_score = len(words & entry_words) / len(words | entry_words)
+                confidence = self.ngram_weight * ngram_score + (1 - self.ngram_weight) * word_score
+
+            if(confidence >= min_confidence and (key not in best or confidence > best[key].confidence)):
+                best[key] = TitleMatch(key, entry_title, confidence)
+
+        return sorted(best.values(), key=lambda match: match.confidence, reverse=True)[:limit]
+
+    def match_many(self, titles:list[str], limit:int = 5, min_confidence:float = 0) -> dict[str, list[TitleMatch]]:
+        """Run match for every title against the candidates indexed once, e.g. a whole library against all candidates.
+
+        Args:
+            titles (list[str]): Titles to match, e.g. the titles of every series of a Komga library.
+            limit (int, optional): Maximum matches returned per title. Defaults to 5.
+            min_confidence (float, optional): Matches below this confidence are dropped. Defaults to 0.
+
+        Returns:
+            dict[str, list[TitleMatch]]: Matches of every title, highest confidence first.
+        """
+        return {title: self.match(title, limit, min_confidence) for title in dict.fromkeys(titles)}
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @staticmethod
+    def normalize(title:str) -> str:
+        """Casefold and turn punctuation into single spaces."""
+        return " ".join(re.sub(r"[\W_]+", " ", title.casefold()).split())
+
+    def __ngrams(self, normalized:str) -> set[str]:
+        padded = f" {normalized} "
+
+        if(len(padded) <= self.n):
+            return {padded}
+
+        return {padded[start:start + self.n] for start in range(len(padded) - self.n + 1)}
+
+    @staticmethod
+    def all_titles(titles:dict) -> list[str]:
+        """Main title followed by every alt title, titles being as returned by the providers' get_titles."""
+        all_titles = [titles["main"]]
+
+        for title in titles["alt_titles"]:
+            all_titles.extend(title.values())
+
+        return [title for title in all_titles if title]
@@ -0,0 +1,236 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+@dataclass
+class Lease():
+    """A series handed to one worker until lease_expires, then to another worker if it was not completed."""
+    series: dict
+    library_id: str
+    attempts: int
+    lease_expires: float
+
+
+class WorkQueue():
+    """Durable queue of Komga series to sync, stored in SQLite so that several processes, or machines sharing the file, drain it.
+    Workers lease series then complete or fail them, extending the leases of series still in progress.
+    Failed series are retried after an exponential delay up to max_attempts, series of a worker that died are leased again once their lease expires.
+    """
+
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path:str, lease_seconds:float = 600, max_attempts:int = 3, retry_delay:float = 60, wal:bool = True) -> None:
+        """
+        Args:
+            path (str): SQLite database file, created if it does not exist.
+            lease_seconds (float, optional): Seconds a worker has to process a leased series. Defaults to 10 minutes.
+            max_attempts (int, optional): Attempts before a series is marked failed. Defaults to 3.
+            retry_delay (float, optional): Seconds before the first retry, doubled after every attempt. Defaults to 60.
+            wal (bool, optional): Use write-ahead logging. WAL needs memory shared between the processes,
+                disable it when the file is on a network volume used by several machines. Defaults to True.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.__lock = threading.Lock()
+        # Autocommit, transactions are opened with BEGIN IMMEDIATE so that leasing holds the write lock from its first read.
+        self.__connection = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+
+        # Outside of a transaction, the journal mode cannot change within one.
+        self.__connection.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+
+        with self.__transaction():
+            self.__connection.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    series_id TEXT PRIMARY KEY,
+                    library_id TEXT,
+                    series TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    available_at REAL NOT NULL,
+                    lease_expires REAL,
+                    last_error TEXT,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)")
+
+    @staticmethod
+    def default_owner() -> str:
+        """Name of this process, unique among the workers of every machine."""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def enqueue(self, series_list, library_id:str = None) -> int:
+        """Add series to the queue. Series already pending or leased are left as they are,
+        done or failed ones are queued again with their attempts reset.
+
+        Args:
+            series_list (Iterable[dict]): Series as returned by KomgaConnector.iter_series.
+            library_id (str, optional): Library of the series. Defaults to their "libraryId".
+
+        Returns:
+            int: Series added or queued again.
+        """
+        now = time.time()
+        rows = [
+            (series["id"], library_id or series.get("libraryId"), json.dumps(series), WorkQueue.PENDING, now, now, WorkQueue.DONE, WorkQueue.FAILED)
+            for series in series_list
+        ]
+
+        with self.__transaction():
+            before = self.__connection.total_changes
+            self.__connection.executemany(
+                """INSERT INTO jobs (series_id, library_id, series, status, available_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (series_id) DO UPDATE SET
+                    library_id = excluded.library_id, series = excluded.series, status = excluded.status, attempts = 0,
+                    owner = NULL, lease_expires = NULL, last_error = NULL, available_at = excluded.available_at, updated_at = excluded.updated_at
+                WHERE jobs.status IN (?, ?)""",
+                rows
+            )
+
+            return self.__connection.total_changes - before
+
+    def lease(self, owner:str, count:int = 1) -> list[Lease]:
+        """Lease up to count series that are due, expired leases of other workers included.
+        Expired leases that used the last attempt are marked failed instead.
+
+        Args:
+            owner (str): Worker leasing the series, see default_owner.
+            count (int, optional): Maximum series leased. Defaults to 1.
+
+        Returns:
+            list[Lease]: Leased series, empty if none is due.
+        """
+        now = time.time()
+        lease_expires = now + self.lease_seconds
+
+        with self.__transaction():
+            # The worker of these leases died or overran lease_seconds on the last attempt.
+            self.__connection.execute(
+                """UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ?
+                WHERE status = ? AND lease_expires <= ? AND attempts >= ?""",
+                (WorkQueue.FAILED, "lease expired", now, WorkQueue.LEASED, now, self.max_attempts)
+            )
+
+            rows = self.__connection.execute(
+                """SELECT series_id, library_id, series, attempts FROM jobs
+                WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires <= ?)
+                ORDER BY available_at LIMIT ?""",
+                (WorkQueue.PENDING, now, WorkQueue.LEASED, now, count)
+            ).fetchall()
+
+            self.__connection.executemany(
+                "UPDATE jobs SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE series_id = ?",
+                [(WorkQueue.LEASED, owner, lease_expires, now, row[0]) for row in rows]
+            )
+
+        return [Lease(json.loads(series), library_id, attempts + 1, lease_expires) for _, library_id, series, attempts in rows]
+
+    def extend(self, series_ids:list[str], owner:str) -> int:
+        """Renew the leases of series still in progress, so that they do not expire and go to another worker.
+        Call it well within lease_seconds.
+
+        Returns:
+            int: Leases renewed, fewer than series_ids if some were lost.
+        """
+        now = time.time()
+
+        with self.__transaction():
+            cursor = self.__connection.executemany(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE series_id = ? AND status = ? AND owner = ?",
+                [(now + self.lease_seconds, now, series_id, WorkQueue.LEASED, owner) for series_id in series_ids]
+            )
+
+        return cursor.rowcount
+
+    def complete(self, series_id:str, owner:str) -> bool:
+        """Mark a leased series as done.
+
+        Returns:
+            bool: False if the lease was lost (expired and taken by another worker), the result is not recorded.
+        """
+        with self.__transaction():
+            cursor = self.__connection.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL, last_error = NULL, updated_at = ? WHERE series_id = ? AND status = ? AND owner = ?",
+                (WorkQueue.DONE, time.time(), series_id, WorkQueue.LEASED, owner)
+            )
+
+        return cursor.rowcount == 1
+
+    def fail(self, series_id:str, owner:str, error:str) -> bool:
+        """Give back a leased series after an error. It is retried after retry_delay * 2 ** (attempts - 1) seconds,
+        or marked failed once it was attempted max_attempts times.
+
+        Returns:
+            bool: False if the lease was lost (expired and taken by another worker).
+        """
+        now = time.time()
+
+        with self.__transaction():
+            row = self.__connection.execute(
+                "SELECT attempts FROM jobs WHERE series_id = ? AND status = ? AND owner = ?", (series_id, WorkQueue.LEASED, owner)
+            ).fetchone()
+
+            if(row is None):
+                return False
+
+            attempts = row[0]
+            status = WorkQueue.FAILED if attempts >= self.max_attempts else WorkQueue.PENDING
+
+            self.__connection.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL, last_error = ?, available_at = ?, updated_at = ? WHERE series_id = ?",
+                (status, error, now + self.retry_delay * 2 ** (attempts - 1), now, series_id)
+            )
+
+        return True
+
+    def remaining(self) -> int:
+        """Series pending or leased, including the ones waiting for a retry."""
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (WorkQueue.PENDING, WorkQueue.LEASED)
+            ).fetchone()[0]
+
+    def counts(self) -> dict[str, int]:
+        """Series per status."""
+        with self.__lock:
+            rows = self.__connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+
+        return {status: 0 for status in (WorkQueue.PENDING, WorkQueue.LEASED, WorkQueue.DONE, WorkQueue.FAILED)} | dict(rows)
+
+    def errors(self, limit:int = 20) -> list[tuple[str, str]]:
+        """Titles and last errors of the failed series."""
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT series, last_error FROM jobs WHERE status = ? ORDER BY updated_at DESC LIMIT ?", (WorkQueue.FAILED, limit)
+            ).fetchall()
+
+        return [(json.loads(series)["metadata"]["title"], error) for series, error in rows]
+
+    def close(self) -> None:
+        self.__connection.close()
+
+    @contextmanager
+    def __transaction(self):
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                yield
+
+            except BaseException:
+                self.__connection.execute("ROLLBACK")
+                raise
+
+            self.__connection.execute("COMMIT")
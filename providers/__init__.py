@@ -1,7 +1,52 @@
-__all__ = ["manga_metadata", "mangadex", "mangaupdates", "provider_exceptions", "provider"]
+__all__ = ["manga_metadata", "mangadex", "mangaupdates", "provider_exceptions", "provider", "cache", "cover_art", "async_providers", "transport", "rate_limiter", "catalog", "composite", "metrics", "search_candidate", "retry"]
 
-from .manga_metadata import MangaMetadata
-from .mangadex import MangaDex
-from .mangaupdates import MangaUpdates
-from .provider_exceptions import ProviderExceptions, MangaNotFoundError
-from .provider import Provider
\ No newline at end of file
+import importlib
+
+# Exported names and the submodule defining them. Submodules are only imported on first access (PEP 562),
+# so "from providers import MangaDex" does not pay for aiohttp, PIL or the other providers.
+_EXPORTS = {
+    "MangaMetadata": "manga_metadata",
+    "SearchCandidate": "search_candidate",
+    "MangaDex": "mangadex",
+    "MangaUpdates": "mangaupdates",
+    "ProviderExceptions": "provider_exceptions",
+    "MangaNotFoundError": "provider_exceptions",
+    "RateLimitedError": "provider_exceptions",
+    "ResponseTooLargeError": "provider_exceptions",
+    "CircuitOpenError": "provider_exceptions",
+    "Provider": "provider",
+    "ResponseCache": "cache",
+    "MemoryCache": "cache",
+    "SQLiteCache": "cache",
+    "CacheEntry": "cache",
+    "CoverArt": "cover_art",
+    "AsyncProvider": "async_providers",
+    "AsyncMangaDex": "async_providers",
+    "AsyncMangaUpdates": "async_providers",
+    "HttpTransport": "transport",
+    "RateLimiter": "rate_limiter",
+    "TokenBucket": "rate_limiter",
+    "RetryPolicy": "retry",
+    "CircuitBreaker": "retry",
+    "RetryLoop": "retry",
+    "LocalCatalog": "catalog",
+    "CompositeProvider": "composite",
+    "MetricsRegistry": "metrics",
+    "Histogram": "metrics",
+    "profiled": "metrics"
+}
+
+
+def __getattr__(name:str):
+    if(name not in _EXPORTS):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    # Cached so later lookups skip __getattr__.
+    globals()[name] = value
+
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_EXPORTS))
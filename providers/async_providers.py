@@ -0,0 +1,389 @@
+import asyncio
+import json
+import time
+from collections.abc import Mapping
+
+from .provider import Provider
+from .provider_exceptions import *
+from .manga_metadata import MangaMetadata
+from .cover_art import CoverArt
+from .mangadex import MangaDex
+from .mangaupdates import MangaUpdates
+from .transport import HttpTransport
+from .rate_limiter import RateLimiter
+from .retry import RetryPolicy, CircuitBreaker, RetryLoop
+from .metrics import MetricsRegistry
+
+try:
+    import aiohttp
+except ImportError:
+    # Optional dependency, only needed by the async API.
+    aiohttp = None
+
+
+class AsyncProvider():
+    """Base class for asyncio counterparts of the providers.
+    Parsing is delegated to the synchronous provider class (PROVIDER), only the transport differs.
+    Requests of one instance share one connection pool and at most max_concurrency are in flight at once.
+
+    Usage:
+        async with AsyncMangaDex(max_concurrency=10) as mangadex:
+            metadata = await asyncio.gather(*[mangadex.get_metadata(id_token) for id_token in id_tokens])
+    """
+
+    PROVIDER: Provider = None
+
+    def __init__(self, max_concurrency:int = 10, timeout:float = 30, rate_limiter:RateLimiter = None, max_rate_limit_retries:int = 3,
+                 retry_policy:RetryPolicy = None, circuit_breaker:CircuitBreaker = None) -> None:
+        """
+        Args:
+            max_concurrency (int, optional): Maximum requests in flight at once. Defaults to 10.
+            timeout (float, optional): Total timeout of one request in seconds. Defaults to 30.
+            rate_limiter (RateLimiter, optional): Scheduler of the requests. Defaults to RateLimiter.shared().
+            max_rate_limit_retries (int, optional): Retries of a request answered with 429. Defaults to 3.
+            retry_policy (RetryPolicy, optional): Retries of server errors, timeouts and connection errors. Defaults to RetryPolicy().
+            circuit_breaker (CircuitBreaker, optional): Breaker failing fast for hosts that keep failing. Defaults to CircuitBreaker.shared().
+        """
+        if(aiohttp is None):
+            raise ImportError("aiohttp is required for the async providers. Install it with 'pip install aiohttp'.")
+
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.session = None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter.shared()
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker.shared()
+
+    async def __aenter__(self) -> "AsyncProvider":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if(self.session is not None):
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        # Created lazily as it must be bound to the running event loop.
+        if(self.session is None):
+            self.session = aiohttp.ClientSession(
+                headers=HttpTransport.DEFAULT_HEADERS,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+            )
+
+        return self.session
+
+    async def _request(self, method:str, url:str, max_bytes:int = None, **kwargs) -> tuple[int, Mapping, bytes]:
+        """Send one request within the concurrency and rate limits, 429 responses are retried after their Retry-After,
+        server errors, timeouts and connection errors as retry_policy allows. Requests to a host whose circuit is open are not sent.
+        Raise ProviderExceptions.ResponseTooLargeError as soon as the body exceeds max_bytes.
+
+        Returns:
+            tuple[int, Mapping, bytes]: Status code, response headers (looked up case-insensitively, like requests' headers) and body.
+        """
+        metrics = MetricsRegistry.shared()
+        service = self.PROVIDER.PROVIDER_NAME
+        loop = RetryLoop(method, url, service, self.retry_policy, self.circuit_breaker, self.rate_limiter, self.max_rate_limit_retries)
+
+        while(True):
+            if(not loop.allow()):
+                raise CircuitOpenError(f"Too many consecutive failures, requests are paused. {url}", service)
+
+            with metrics.time("rate_limit_wait_seconds", service=service):
+                await self.rate_limiter.acquire_async(url)
+
+            async with self.semaphore:
+                try:
+                    start = time.perf_counter()
+
+                    async with self._get_session().request(method, url, **kwargs) as api_response:
+                        status, headers, body = api_response.status, api_response.headers, await self.__read(api_response, max_bytes)
+
+                    metrics.record_request(
+                        service, method, status, time.perf_counter() - start, len(body),
+                        len(json.dumps(kwargs["json"])) if "json" in kwargs else len(kwargs.get("data") or b"")
+                    )
+
+                except ResponseTooLargeError:
+                    # The host answered, only the body is refused.
+                    self.circuit_breaker.record_success(url)
+                    raise
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status, error = None, e
+
+            if(status is None):
+                delay = loop.on_error(True)
+
+                if(delay is None):
+                    raise ProviderExceptions(f"{type(error).__name__} after {loop.attempt} retries. {url}", service)
+
+                await asyncio.sleep(delay)
+                continue
+
+            delay = loop.on_response(status, headers)
+
+            if(delay is None):
+                if(status == 429):
+                    raise RateLimitedError(f"Still rate limited after {self.max_rate_limit_retries} retries. {url}", service)
+
+                return status, headers, body
+
+            await asyncio.sleep(delay)
+
+    async def __read(self, api_response:"aiohttp.ClientResponse", max_bytes:int = None) -> bytes:
+        """Body of the response, streamed so that at most max_bytes are held in memory."""
+        if(max_bytes is None):
+            return await api_response.read()
+
+        if((api_response.content_length or 0) > max_bytes):
+            raise ResponseTooLargeError(f"Response of {api_response.content_length} bytes exceeds {max_bytes} bytes. {api_response.url}", self.PROVIDER.PROVIDER_NAME)
+
+        body = bytearray()
+        async for chunk in api_response.content.iter_chunked(65536):
+            body += chunk
+
+            if(len(body) > max_bytes):
+                # Content-Length was missing or wrong.
+                raise ResponseTooLargeError(f"Response exceeds {max_bytes} bytes. {api_response.url}", self.PROVIDER.PROVIDER_NAME)
+
+        return bytes(body)
+
+    async def _get_json(self, method:str, url:str, request_name:str, **kwargs) -> dict:
+        status, _, body = await self._request(method, url, **kwargs)
+
+        if(status != 200):
+            #Failed API request.
+            raise ProviderExceptions(f"API response for '{request_name}' was ({status}).", self.PROVIDER.PROVIDER_NAME)
+
+        return json.loads(body)
+
+    async def _get_manga_info(self, id_token:str, url:str) -> dict:
+        """Async counterpart of Provider.cached_get_json, sharing the same cache.
+        """
+        cache = self.PROVIDER.get_cache()
+        key = self.PROVIDER.cache_key(id_token)
+        entry = cache.get(key)
+
+        if(entry is not None and entry.is_fresh()):
+            self.PROVIDER.record_cache_lookup("hit")
+            return entry.body
+
+        status, headers, body = await self._request(
+            "GET",
+            url,
+            headers=entry.revalidation_headers() if entry is not None else {}
+        )
+
+        if(status == 304 and entry is not None):
+            #Not modified; the stale entry is still valid.
+            self.PROVIDER.record_cache_lookup("revalidated")
+            cache.set(key, entry.refreshed(cache.ttl))
+            return entry.body
+
+        self.PROVIDER.record_cache_lookup("miss")
+
+        if(status >= 500):
+            # Still failing after the retries, the manga may well exist.
+            raise ProviderExceptions(f"API response for '__get_manga_info' was ({status}).", self.PROVIDER.PROVIDER_NAME)
+
+        if(status != 200):
+            raise MangaNotFoundError(f"API response for '__get_manga_info' was ({status}).", self.PROVIDER.PROVIDER_NAME)
+
+        manga_info = json.loads(body)
+        cache.set(key, cache.build_entry(manga_info, headers))
+
+        return manga_info
+
+    async def load_cover(self, metadata:MangaMetadata) -> CoverArt:
+        """Download the cover art of metadata without blocking the event loop.
+        The downloaded cover replaces metadata.cover_art and is returned.
+        """
+        if(metadata.cover_art.is_downloaded):
+            return metadata.cover_art
+
+        status, _, body = await self._request("GET", metadata.cover_art.url, max_bytes=self.PROVIDER.MAX_COVER_DOWNLOAD_BYTES)
+
+        if(status != 200):
+            raise ProviderExceptions(f"Invalid cover URL. {metadata.cover_art.url}", self.PROVIDER.PROVIDER_NAME)
+
+        metadata.cover_art = CoverArt(metadata.cover_art.url, data=body)
+
+        return metadata.cover_art
+
+    async def get_metadata_many(self, id_tokens:list[str]) -> tuple[dict[str, MangaMetadata], dict[str, ProviderExceptions]]:
+        """Retrieve metadata of many mangas concurrently.
+        Failures are reported per id instead of failing the whole batch.
+
+        Returns:
+            tuple[dict[str, MangaMetadata], dict[str, ProviderExceptions]]: Metadata and errors, both keyed by id_token.
+        """
+        id_tokens = list(dict.fromkeys(id_tokens))
+        results = {}
+        errors = {}
+
+        responses = await asyncio.gather(
+            *[self.get_metadata(id_token) for id_token in id_tokens],
+            return_exceptions=True
+        )
+
+        for id_token, response in zip(id_tokens, responses):
+            if(isinstance(response, ProviderExceptions)):
+                errors[id_token] = response
+
+            elif(isinstance(response, BaseException)):
+                raise response
+
+            else:
+                results[id_token] = response
+
+        return results, errors
+
+
+class AsyncMangaDex(AsyncProvider):
+    """Asyncio counterpart of MangaDex.
+    """
+
+    PROVIDER = MangaDex
+
+    async def search_manga(self, name:str) -> list[str]:
+        query = MangaDex.normalize_query(name)
+        cache_key = MangaDex.search_cache_key(query)
+        cached_results = MangaDex.get_cached_search(cache_key)
+
+        if(cached_results is not None):
+            return cached_results
+
+        response = await self._get_json(
+            "GET",
+            f"{MangaDex.BASE_URL}/manga",
+            "search_manga",
+            params={"title": query,
+                    "order[relevance]":"desc"
+                }
+        )
+
+        results = [manga["id"] for manga in response["data"]]
+        MangaDex.set_cached_search(cache_key, results)
+
+        return results
+
+    async def get_metadata(self, id_token:str) -> MangaMetadata:
+        manga_info = await self._get_manga_info(
+            id_token,
+            f"{MangaDex.BASE_URL}/manga/{id_token}?includes[]=cover_art"
+        )
+
+        return MangaDex.metadata_from_response(id_token, manga_info)
+
+    async def get_metadata_many(self, id_tokens:list[str]) -> tuple[dict[str, MangaMetadata], dict[str, ProviderExceptions]]:
+        """Async counterpart of MangaDex.get_metadata_many, chunks are requested concurrently.
+        """
+        id_tokens = list(dict.fromkeys(id_tokens))
+        chunks = [id_tokens[start:start + MangaDex.BATCH_SIZE] for start in range(0, len(id_tokens), MangaDex.BATCH_SIZE)]
+        results = {}
+        errors = {}
+
+        responses = await asyncio.gather(
+            *[self.__get_manga_info_many(chunk) for chunk in chunks],
+            return_exceptions=True
+        )
+
+        for chunk, manga_infos in zip(chunks, responses):
+            if(isinstance(manga_infos, ProviderExceptions)):
+                for id_token in chunk:
+                    errors[id_token] = manga_infos
+                continue
+
+            if(isinstance(manga_infos, BaseException)):
+                raise manga_infos
+
+            for id_token in chunk:
+                if(id_token not in manga_infos):
+                    errors[id_token] = MangaNotFoundError("Manga was not returned by the batch request.", MangaDex.PROVIDER_NAME)
+                    continue
+
+                try:
+                    results[id_token] = MangaDex.metadata_from_response(id_token, manga_infos[id_token])
+
+                except ProviderExceptions as e:
+                    errors[id_token] = e
+
+        return results, errors
+
+    async def __get_manga_info_many(self, id_tokens:list[str]) -> dict[str, dict]:
+        cache = MangaDex.get_cache()
+        manga_infos = {}
+
+        for id_token in id_tokens:
+            entry = cache.get(MangaDex.cache_key(id_token))
+
+            if(entry is not None and entry.is_fresh()):
+                manga_infos[id_token] = entry.body
+
+        id_tokens = [id_token for id_token in id_tokens if id_token not in manga_infos]
+
+        MangaDex.record_cache_lookup("hit", len(manga_infos))
+        MangaDex.record_cache_lookup("miss", len(id_tokens))
+
+        if(not id_tokens):
+            return manga_infos
+
+        response = await self._get_json(
+            "GET",
+            f"{MangaDex.BASE_URL}/manga",
+            "__get_manga_info_many",
+            params=[("ids[]", id_token) for id_token in id_tokens]
+                + [("includes[]", "cover_art"), ("limit", str(len(id_tokens)))]
+                + [("contentRating[]", rating) for rating in MangaDex.CONTENT_RATINGS]
+        )
+
+        for manga in response["data"]:
+            manga_infos[manga["id"]] = {"data": manga}
+            cache.set(MangaDex.cache_key(manga["id"]), cache.build_entry(manga_infos[manga["id"]]))
+
+        return manga_infos
+
+
+class AsyncMangaUpdates(AsyncProvider):
+    """Asyncio counterpart of MangaUpdates.
+    """
+
+    PROVIDER = MangaUpdates
+
+    async def search_manga(self, name:str, page_limit:int = 1, per_page_limit:int = 10) -> list[str]:
+        query = MangaUpdates.normalize_query(name)
+        cache_key = MangaUpdates.search_cache_key(query, page_limit=page_limit, per_page_limit=per_page_limit)
+        cached_results = MangaUpdates.get_cached_search(cache_key)
+
+        if(cached_results is not None):
+            return cached_results
+
+        response = await self._get_json(
+            "POST",
+            f"{MangaUpdates.BASE_URL}/v1/series/search",
+            "search_manga",
+            json={
+                "search": query,
+                "page": page_limit,
+                "perpage": per_page_limit
+            }
+        )
+
+        results = [manga["record"]["series_id"] for manga in response["results"]]
+        MangaUpdates.set_cached_search(cache_key, results)
+
+        return results
+
+    async def get_metadata(self, id_token:str) -> MangaMetadata:
+        manga_info = await self._get_manga_info(
+            id_token,
+            f"{MangaUpdates.BASE_URL}/v1/series/{id_token}"
+        )
+
+        return MangaUpdates.metadata_from_response(id_token, manga_info)
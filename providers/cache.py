@@ -0,0 +1,207 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+
+@dataclass
+class CacheEntry():
+    """One cached API response body with the validators needed to revalidate it."""
+    body: dict
+    expires_at: float
+    etag: str = None
+    last_modified: str = None
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def revalidation_headers(self) -> dict:
+        """Conditional request headers, the server answers 304 if the cached body is still valid."""
+        headers = {}
+
+        if(self.etag):
+            headers["If-None-Match"] = self.etag
+
+        if(self.last_modified):
+            headers["If-Modified-Since"] = self.last_modified
+
+        return headers
+
+    def refreshed(self, ttl:float) -> "CacheEntry":
+        return replace(self, expires_at=time.time() + ttl)
+
+
+class ResponseCache(ABC):
+    """Abstract class for provider response caches.
+    Stale entries are kept (until evicted) so they can be revalidated instead of downloaded again.
+    """
+
+    def __init__(self, ttl:float = 3600, max_entries:int = 10000) -> None:
+        """
+        Args:
+            ttl (float, optional): Seconds an entry is considered fresh. Defaults to 3600.
+            max_entries (int, optional): Least recently used entries are evicted above this size. Defaults to 10000.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def build_entry(self, body:dict, headers:dict = None, ttl:float = None) -> CacheEntry:
+        headers = headers or {}
+
+        return CacheEntry(
+            body=body,
+            expires_at=time.time() + (self.ttl if ttl is None else ttl),
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified")
+        )
+
+    @abstractmethod
+    def get(self, key:str) -> CacheEntry:
+        """Get the entry stored under key, fresh or stale. None if there is no entry."""
+        pass
+
+    @abstractmethod
+    def set(self, key:str, entry:CacheEntry) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key:str) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+
+class MemoryCache(ResponseCache):
+    """In-memory LRU cache, only lives as long as the process."""
+
+    def __init__(self, ttl:float = 3600, max_entries:int = 10000) -> None:
+        super().__init__(ttl, max_entries)
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key:str) -> CacheEntry:
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if(entry is not None):
+                self.__entries.move_to_end(key)
+
+            return entry
+
+    def set(self, key:str, entry:CacheEntry) -> None:
+        with self.__lock:
+            self.__entries[key] = entry
+            self.__entries.move_to_end(key)
+
+            while(len(self.__entries) > self.max_entries):
+                self.__entries.popitem(last=False)
+
+    def delete(self, key:str) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+
+class SQLiteCache(ResponseCache):
+    """On-disk cache backed by a SQLite file, shared across runs and processes.
+    Recency is kept to ACCESS_RESOLUTION seconds so reads seldom write, and least recently used entries are evicted
+    in batches once the table exceeds max_entries instead of on every write.
+    """
+
+    ACCESS_RESOLUTION = 60 # Seconds, accessed_at is only updated on reads once it is older than this.
+
+    def __init__(self, path:str, ttl:float = 86400, max_entries:int = 100000) -> None:
+        """
+        Args:
+            path (str): SQLite database file, created if it does not exist.
+            ttl (float, optional): Seconds an entry is considered fresh. Defaults to 86400.
+            max_entries (int, optional): Least recently used entries are evicted above this size. Defaults to 100000.
+        """
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+
+        with self.__connection:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses(accessed_at)")
+
+        # Estimate, other processes write to the file too. Counted again before evicting.
+        self.__count = self.__connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        # Evicted beyond the excess so that a full cache does not evict on every write.
+        self.__eviction_batch = max(1, max_entries // 100)
+
+    def get(self, key:str) -> CacheEntry:
+        with self.__lock, self.__connection:
+            row = self.__connection.execute(
+                "SELECT body, expires_at, etag, last_modified, accessed_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if(row is None):
+                return None
+
+            now = time.time()
+            if(now - row[4] >= SQLiteCache.ACCESS_RESOLUTION):
+                self.__connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+
+        return CacheEntry(body=json.loads(row[0]), expires_at=row[1], etag=row[2], last_modified=row[3])
+
+    def set(self, key:str, entry:CacheEntry) -> None:
+        with self.__lock, self.__connection:
+            exists = self.__connection.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(entry.body), entry.expires_at, entry.etag, entry.last_modified, time.time())
+            )
+
+            if(not exists):
+                self.__count += 1
+
+            if(self.__count > self.max_entries):
+                self.__evict()
+
+    def delete(self, key:str) -> None:
+        with self.__lock, self.__connection:
+            self.__count -= self.__connection.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+
+    def clear(self) -> None:
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM responses")
+            self.__count = 0
+
+    def close(self) -> None:
+        self.__connection.close()
+
+    def __evict(self) -> None:
+        """Delete the least recently used entries above max_entries, and a batch more. Called within a transaction."""
+        self.__count = self.__connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+        if(self.__count <= self.max_entries):
+            return
+
+        # Walks the accessed_at index from the oldest entry, only the evicted rows are read.
+        self.__count -= self.__connection.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+            (self.__count - self.max_entries + self.__eviction_batch,)
+        ).rowcount
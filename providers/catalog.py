@@ -0,0 +1,162 @@
+import sqlite3
+import threading
+import time
+
+from .manga_metadata import MangaMetadata
+from .provider_exceptions import ProviderExceptions
+
+
+class LocalCatalog():
+    """Offline catalog of provider titles, searchable with SQLite FTS5.
+    Populated from provider responses (see Provider.set_catalog) and refreshed incrementally with refresh(),
+    so searches can be answered locally without a request or the provider's rate limits.
+    """
+
+    def __init__(self, path:str) -> None:
+        """
+        Args:
+            path (str): SQLite database file, created if it does not exist.
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+
+        with self.__connection:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS series (
+                    rowid INTEGER PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    id_token TEXT NOT NULL,
+                    main_title TEXT,
+                    titles TEXT NOT NULL,
+                    updated_at TEXT,
+                    indexed_at REAL NOT NULL,
+                    UNIQUE(provider, id_token)
+                );
+
+                CREATE VIRTUAL TABLE IF NOT EXISTS series_fts USING fts5(
+                    titles, content='series', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+                );
+
+                CREATE TRIGGER IF NOT EXISTS series_insert AFTER INSERT ON series BEGIN
+                    INSERT INTO series_fts(rowid, titles) VALUES (new.rowid, new.titles);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS series_delete AFTER DELETE ON series BEGIN
+                    INSERT INTO series_fts(series_fts, rowid, titles) VALUES ('delete', old.rowid, old.titles);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS series_update AFTER UPDATE ON series BEGIN
+                    INSERT INTO series_fts(series_fts, rowid, titles) VALUES ('delete', old.rowid, old.titles);
+                    INSERT INTO series_fts(rowid, titles) VALUES (new.rowid, new.titles);
+                END;
+
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    provider TEXT PRIMARY KEY,
+                    last_updated_at TEXT NOT NULL
+                );
+                """
+            )
+
+    def add(self, provider:str, id_token:str, titles:dict, updated_at:str = None) -> None:
+        """Index or re-index the titles of one manga.
+
+        Args:
+            provider (str): PROVIDER_NAME of the provider.
+            id_token (str): Used to uniquely identify the manga on the provider site.
+            titles (dict): Titles as returned by the providers' get_titles.
+            updated_at (str, optional): Provider's last modification time of the manga.
+        """
+        all_titles = [titles["main"]]
+        for title in titles["alt_titles"]:
+            all_titles.extend(title.values())
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                """INSERT INTO series(provider, id_token, main_title, titles, updated_at, indexed_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(provider, id_token) DO UPDATE SET
+                    main_title = excluded.main_title,
+                    titles = excluded.titles,
+                    updated_at = COALESCE(excluded.updated_at, series.updated_at),
+                    indexed_at = excluded.indexed_at""",
+                (provider, id_token, titles["main"], "\n".join(title for title in all_titles if title), updated_at, time.time())
+            )
+
+    def add_metadata(self, metadata:MangaMetadata, updated_at:str = None) -> None:
+        self.add(metadata.provider, metadata.id_token, metadata.titles, updated_at)
+
+    def search(self, provider:str, name:str, limit:int = 10) -> list[str]:
+        """Full text search of the titles of one provider.
+
+        Args:
+            provider (str): PROVIDER_NAME of the provider.
+            name (str): Name of manga to be queried, every word must appear in one of the titles.
+            limit (int, optional): Maximum number of results. Defaults to 10.
+
+        Returns:
+            list[str]: list of identification tokens, most relevant first.
+        """
+        words = "".join(character if character.isalnum() else " " for character in name).split()
+
+        if(not words):
+            return []
+
+        # Quoted so words are never read as FTS5 operators.
+        query = " ".join(f'"{word}"' for word in words)
+
+        with self.__lock:
+            rows = self.__connection.execute(
+                """SELECT series.id_token FROM series_fts JOIN series ON series.rowid = series_fts.rowid
+                WHERE series_fts MATCH ? AND series.provider = ?
+                ORDER BY series_fts.rank LIMIT ?""",
+                (query, provider, limit)
+            ).fetchall()
+
+        return [row[0] for row in rows]
+
+    def last_updated_at(self, provider:str) -> str:
+        """Newest provider modification time fetched by refresh(), None if it never ran."""
+        with self.__lock:
+            row = self.__connection.execute("SELECT last_updated_at FROM sync_state WHERE provider = ?", (provider,)).fetchone()
+
+        return row[0] if row else None
+
+    def refresh(self, provider, since:str = None) -> int:
+        """Index every manga the provider changed since the last refresh.
+        Only providers listing their updated mangas with iter_updated_since can be refreshed: MangaDex.
+        Raise ProviderExceptions for the others (MangaUpdates).
+
+        Args:
+            provider (Provider): Provider class.
+            since (str, optional): Override the last refresh time, e.g. "2000-01-01T00:00:00" for a full import.
+
+        Returns:
+            int: Number of indexed mangas.
+        """
+        if(not hasattr(provider, "iter_updated_since")):
+            raise ProviderExceptions("The provider does not support listing updated mangas, the catalog cannot be refreshed from it.", provider.PROVIDER_NAME)
+
+        since = since or self.last_updated_at(provider.PROVIDER_NAME) or "2000-01-01T00:00:00"
+        count = 0
+
+        for id_token, titles, updated_at in provider.iter_updated_since(since):
+            self.add(provider.PROVIDER_NAME, id_token, titles, updated_at)
+            count += 1
+
+            if(updated_at and updated_at > since):
+                since = updated_at
+                with self.__lock, self.__connection:
+                    self.__connection.execute(
+                        "INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (provider.PROVIDER_NAME, since)
+                    )
+
+        return count
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM series").fetchone()[0]
+
+    def close(self) -> None:
+        self.__connection.close()
@@ -0,0 +1,268 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+from .provider import Provider
+from .provider_exceptions import *
+from .manga_metadata import MangaMetadata
+from .cover_art import CoverArt
+from .mangadex import MangaDex
+from .mangaupdates import MangaUpdates
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class CompositeProvider(Provider):
+    """Provider querying several providers concurrently, so a lookup costs the latency of the slowest
+    provider instead of the sum of all of them.
+
+    Unlike the other providers it is used through an instance, and its id_token is a dict of
+    {PROVIDER_NAME: id_token} with one entry per provider.
+
+    Strategies:
+        "merge": wait for every provider (up to timeout) and merge their fields into one MangaMetadata.
+        "first": query every provider at once and keep the first good response.
+        "hedged": query providers in order, starting the next one only if the previous did not answer within hedge_delay.
+    """
+
+    PROVIDER_NAME = "Composite"
+    STRATEGIES = ["merge", "first", "hedged"]
+    DEFAULT_TIMEOUT = 30 # Seconds, for providers missing from a timeout dict.
+
+    def __init__(self, providers:list = None, strategy:str = "merge", timeout:float | dict[str, float] = DEFAULT_TIMEOUT, hedge_delay:float = 2) -> None:
+        """
+        Args:
+            providers (list[Provider], optional): Provider classes, in priority order. Defaults to [MangaDex, MangaUpdates].
+            strategy (str, optional): One of STRATEGIES. Defaults to "merge".
+            timeout (float | dict[str, float], optional): Seconds to wait for a provider before ignoring it, counted from its own request,
+                or such seconds per PROVIDER_NAME (e.g. {"MangaUpdates": 10}), DEFAULT_TIMEOUT for the others. Defaults to 30.
+            hedge_delay (float, optional): Seconds before the next provider is queried with the "hedged" strategy. Defaults to 2.
+        """
+        if(strategy not in CompositeProvider.STRATEGIES):
+            raise ValueError(f"Unknown strategy '{strategy}', expected one of {CompositeProvider.STRATEGIES}.")
+
+        self.providers = providers if providers is not None else [MangaDex, MangaUpdates]
+        self.strategy = strategy
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.executor = ThreadPoolExecutor(max_workers=4 * len(self.providers), thread_name_prefix="composite")
+
+    def search_manga(self, name:str) -> dict[str, list[str]]:
+        """Search every provider concurrently.
+
+        Returns:
+            dict[str, list[str]]: Identification tokens per PROVIDER_NAME, empty for providers that failed or timed out.
+        """
+        results = self.__all(lambda provider: provider.search_manga(name))
+
+        return {provider.PROVIDER_NAME: results.get(provider, []) for provider in self.providers}
+
+    def get_metadata(self, id_tokens:dict[str, str]) -> MangaMetadata:
+        """Get the metadata of a manga from every provider it has an id_token for, combined according to the strategy.
+        Raise ProviderExceptions.MangaNotFoundError if no provider returned it.
+        """
+        providers = [provider for provider in self.providers if provider.PROVIDER_NAME in id_tokens]
+
+        return self.__combine(
+            lambda provider: provider(id_tokens[provider.PROVIDER_NAME]).get_metadata(),
+            providers
+        )
+
+    def find_metadata(self, name:str, match_policy = None, max_candidates:int = 5) -> MangaMetadata:
+        """Search and fetch on every provider concurrently and combine the chosen candidates according to the strategy.
+
+        Args:
+            name (str): Name of manga to be queried.
+            match_policy (Callable[[str, list], object], optional): Picks a provider's candidate by its titles, None if none fits. Defaults to the first search result.
+            max_candidates (int, optional): Search results fetched per provider. Defaults to 5.
+
+        Returns:
+            MangaMetadata: Combined metadata, None if no provider had an accepted match.
+        """
+        def find(provider) -> MangaMetadata:
+            # Only the chosen candidate is promoted.
+            return provider.select_candidate(name, provider.search_candidates(name)[:max_candidates], match_policy)
+
+        try:
+            return self.__combine(find, self.providers)
+
+        except MangaNotFoundError:
+            return None
+
+    def get_titles(self, id_tokens:dict[str, str]) -> list[dict]:
+        return self.get_metadata(id_tokens).titles
+
+    def get_tags(self, id_tokens:dict[str, str]) -> list[str]:
+        return self.get_metadata(id_tokens).tags
+
+    def get_genres(self, id_tokens:dict[str, str]) -> list[str]:
+        return self.get_metadata(id_tokens).genres
+
+    def get_summary(self, id_tokens:dict[str, str]) -> str:
+        return self.get_metadata(id_tokens).summary
+
+    def get_cover(self, id_tokens:dict[str, str]) -> "Image.Image":
+        return self.get_metadata(id_tokens).cover_art.image
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __combine(self, task, providers:list) -> MangaMetadata:
+        if(self.strategy == "merge"):
+            results = self.__all(task, providers)
+            metadata_list = [results[provider] for provider in providers if results.get(provider) is not None]
+
+            if(not metadata_list):
+                raise MangaNotFoundError("No provider returned the manga.", CompositeProvider.PROVIDER_NAME)
+
+            return self.merge(metadata_list)
+
+        metadata = self.__first_good(task, providers, hedged=self.strategy == "hedged")
+
+        if(metadata is None):
+            raise MangaNotFoundError("No provider returned the manga.", CompositeProvider.PROVIDER_NAME)
+
+        return metadata
+
+    def __all(self, task, providers:list = None) -> dict:
+        """Run task for every provider concurrently, providers failing or exceeding timeout are left out."""
+        providers = providers if providers is not None else self.providers
+        start = time.monotonic()
+        futures = {self.executor.submit(task, provider): provider for provider in providers}
+        deadlines = {future: start + self.__timeout(provider) for future, provider in futures.items()}
+        pending = set(futures)
+
+        results = {}
+        while(pending):
+            now = time.monotonic()
+            pending = {future for future in pending if deadlines[future] > now}
+
+            if(not pending):
+                break
+
+            done, pending = wait(pending, timeout=min(deadlines[future] for future in pending) - now, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if(future.exception() is None):
+                    results[futures[future]] = future.result()
+
+        return results
+
+    def __first_good(self, task, providers:list, hedged:bool):
+        """First non None result of task, querying providers all at once or hedged one after another.
+        Each provider is waited for until its own timeout, counted from its request.
+        """
+        remaining = list(providers)
+        pending = set()
+        deadlines = {}
+
+        def submit() -> None:
+            provider = remaining.pop(0)
+            future = self.executor.submit(task, provider)
+            deadlines[future] = time.monotonic() + self.__timeout(provider)
+            pending.add(future)
+
+        while(remaining or pending):
+            # Hedged: one more provider per hedge_delay (or as soon as all running ones failed or timed out), otherwise all at once.
+            while(remaining and (not hedged or not pending)):
+                submit()
+
+            now = time.monotonic()
+            pending = {future for future in pending if deadlines[future] > now}
+
+            if(not pending):
+                continue
+
+            remaining_time = min(deadlines[future] for future in pending) - now
+
+            done, pending = wait(
+                pending,
+                timeout=min(self.hedge_delay, remaining_time) if (hedged and remaining) else remaining_time,
+                return_when=FIRST_COMPLETED
+            )
+
+            for future in done:
+                if(future.exception() is None and future.result() is not None):
+                    return future.result()
+
+            if(hedged and remaining and not done):
+                # Nobody answered within hedge_delay, hedge with the next provider.
+                submit()
+
+        return None
+
+    def __timeout(self, provider) -> float:
+        if(isinstance(self.timeout, dict)):
+            return self.timeout.get(provider.PROVIDER_NAME, CompositeProvider.DEFAULT_TIMEOUT)
+
+        return self.timeout
+
+    def merge(self, metadata_list:list[MangaMetadata]) -> MangaMetadata:
+        """Merge metadata of the same manga from several providers, in priority order.
+        Main title from the first provider, union of alt titles, tags and genres, longest summary and highest resolution cover.
+        """
+        alt_titles = []
+        seen_titles = {metadata_list[0].titles["main"].casefold()}
+        for metadata in metadata_list:
+            # Main titles of the other providers become alt titles labeled with the provider name.
+            for title in [{metadata.provider: metadata.titles["main"]}] + metadata.titles["alt_titles"]:
+                value = list(title.values())[0]
+
+                if(value and value.casefold() not in seen_titles):
+                    seen_titles.add(value.casefold())
+                    alt_titles.append(title)
+
+        return MangaMetadata(
+            provider="+".join(metadata.provider for metadata in metadata_list),
+            id_token=";".join(f"{metadata.provider}:{metadata.id_token}" for metadata in metadata_list),
+            titles={"main": metadata_list[0].titles["main"], "alt_titles": alt_titles},
+            tags=CompositeProvider.__union([metadata.tags for metadata in metadata_list]),
+            genres=CompositeProvider.__union([metadata.genres for metadata in metadata_list]),
+            summary=max((metadata.summary or "" for metadata in metadata_list), key=len),
+            cover_art=self.__largest_cover([metadata.cover_art for metadata in metadata_list if metadata.cover_art is not None])
+        )
+
+    def __largest_cover(self, covers:list[CoverArt]) -> CoverArt:
+        """Lazy cover resolving, on first access, to the candidate with the most pixels."""
+        if(len(covers) <= 1):
+            return covers[0] if covers else None
+
+        def fetch_largest(url:str) -> bytes:
+            from PIL import Image
+
+            sizes = {}
+            for cover, future in [(cover, self.executor.submit(lambda cover: cover.data, cover)) for cover in covers]:
+                try:
+                    # Only the header is parsed, the image is not decoded.
+                    width, height = Image.open(BytesIO(future.result())).size
+                    sizes[width * height] = cover
+
+                except (ProviderExceptions, OSError):
+                    continue
+
+            if(not sizes):
+                raise ProviderExceptions("No cover could be downloaded.", CompositeProvider.PROVIDER_NAME)
+
+            largest = sizes[max(sizes)]
+            merged_cover.url = largest.url
+
+            return largest.data
+
+        merged_cover = CoverArt(covers[0].url, fetcher=fetch_largest)
+
+        return merged_cover
+
+    @staticmethod
+    def __union(lists:list[list[str]]) -> list[str]:
+        union = []
+        seen = set()
+
+        for values in lists:
+            for value in values:
+                if(value.casefold() not in seen):
+                    seen.add(value.casefold())
+                    union.append(value)
+
+        return union
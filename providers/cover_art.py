@@ -0,0 +1,117 @@
+import threading
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+from .metrics import MetricsRegistry
+
+if TYPE_CHECKING:
+    # PIL is only imported once an image is decoded.
+    from PIL import Image
+
+
+class CoverArt():
+    """Lazy handle of a cover art image.
+    Holds the URL and only downloads and decodes the image on first access,
+    so metadata-only passes skip the image traffic and decoding.
+    The original encoded bytes are kept (data, content_type), so they can be uploaded without re-encoding.
+    Unknown attributes are delegated to the decoded image, so it can be used like a PIL.Image (e.g. cover_art.save(...)).
+    """
+
+    # Leading bytes of the formats covers are served in.
+    SIGNATURES = {
+        b"\xff\xd8\xff": "image/jpeg",
+        b"\x89PNG\r\n\x1a\n": "image/png",
+        b"GIF87a": "image/gif",
+        b"GIF89a": "image/gif"
+    }
+
+    def __init__(self, url:str, fetcher = None, data:bytes = None) -> None:
+        """
+        Args:
+            url (str): URL of the cover art.
+            fetcher (Callable[[str], bytes], optional): Downloads the raw bytes of url. Required unless data is given.
+            data (bytes, optional): Raw encoded image, if it is already downloaded.
+        """
+        self.url = url
+        self.__fetcher = fetcher
+        self.__data = data
+        self.__image = None
+        self.__lock = threading.Lock()
+
+    @property
+    def is_downloaded(self) -> bool:
+        return self.__data is not None
+
+    @property
+    def data(self) -> bytes:
+        """Raw encoded image, downloaded on first access."""
+        if(self.__data is None):
+            with self.__lock:
+                if(self.__data is None):
+                    if(self.__fetcher is None):
+                        raise ValueError(f"Cover art was not downloaded and has no fetcher. {self.url}")
+
+                    self.__data = self.__fetcher(self.url)
+
+        return self.__data
+
+    @property
+    def content_type(self) -> str:
+        """MIME type of the encoded image, read from its leading bytes. "application/octet-stream" if unknown."""
+        data = self.data
+
+        for signature, content_type in CoverArt.SIGNATURES.items():
+            if(data.startswith(signature)):
+                return content_type
+
+        if(data[:4] == b"RIFF" and data[8:12] == b"WEBP"):
+            return "image/webp"
+
+        return "application/octet-stream"
+
+    @property
+    def image(self) -> "Image.Image":
+        """Decoded RGB image, decoded on first access."""
+        from PIL import Image
+
+        if(self.__image is None):
+            data = self.data
+
+            with self.__lock:
+                if(self.__image is None):
+                    with MetricsRegistry.shared().time("cover_decode_seconds"):
+                        self.__image = Image.open(BytesIO(data)).convert("RGB")
+
+        return self.__image
+
+    def decode(self, max_edge:int = None) -> "Image.Image":
+        """Decoded RGB image, not cached. With max_edge, JPEGs are decoded directly at a reduced size
+        (the smallest 1/2, 1/4 or 1/8 scale whose edges are still at least max_edge) then downscaled to fit max_edge.
+        """
+        from PIL import Image
+
+        if(max_edge is None):
+            return self.image
+
+        with MetricsRegistry.shared().time("cover_decode_seconds"):
+            image = Image.open(BytesIO(self.data))
+            image.draft("RGB", (max_edge, max_edge))
+            image = image.convert("RGB")
+
+        if(max(image.size) > max_edge):
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        return image
+
+    def __getattr__(self, name:str):
+        if(name.startswith("_")):
+            raise AttributeError(name)
+
+        return getattr(self.image, name)
+
+    def _repr_png_(self) -> bytes:
+        """Let IPython's display() render the cover."""
+        return self.image._repr_png_()
+
+    def __repr__(self) -> str:
+        return f"CoverArt(url={self.url!r}, downloaded={self.is_downloaded})"
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from PIL import Image
+from .cover_art import CoverArt
 
 @dataclass
 class MangaMetadata():
@@ -9,7 +9,7 @@ class MangaMetadata():
     tags: list[str]
     genres: list[str]
     summary: str
-    cover_art: Image.Image
+    cover_art: CoverArt
 
     def __repr__(self) -> str:
         return str({
@@ -1,11 +1,16 @@
 from .provider import Provider
 from .provider_exceptions import *
 from .manga_metadata import MangaMetadata
+from .cover_art import CoverArt
+from .search_candidate import SearchCandidate
 
-import requests
 from requests import Response
-from PIL import Image
 from io import BytesIO
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Only imported when cover art is decoded.
+    from PIL import Image
 
 class MangaDex(Provider):
     """Provider class implementation for MangaDex website.
@@ -14,6 +19,10 @@ class MangaDex(Provider):
 
     PROVIDER_NAME = "MangaDex"
     BASE_URL = "https://api.mangadex.org"
+    COVERS_URL = "https://uploads.mangadex.org/covers"
+    BATCH_SIZE = 100 # Maximum "limit" accepted by the "/manga" list endpoint.
+    CONTENT_RATINGS = ["safe", "suggestive", "erotica", "pornographic"]
+    MAX_LIST_OFFSET = 10000 # "offset" + "limit" of the list endpoints cannot exceed this.
 
     def __init__(self, id_token:str) -> None:
         """Initializing object for one manga.
@@ -27,34 +36,87 @@ class MangaDex(Provider):
     def get_metadata(self) -> MangaMetadata:
         manga_info = MangaDex.__get_manga_info(self.id_token)
 
-        filename = MangaDex.__extract_filename_from_response(manga_info)
+        return MangaDex.metadata_from_response(self.id_token, manga_info)
 
-        api_response = requests.get(
-            f"https://uploads.mangadex.org/covers/{self.id_token}/{filename}"
-        )
+    @staticmethod
+    def get_metadata_many(id_tokens:list[str]) -> tuple[dict[str, MangaMetadata], dict[str, ProviderExceptions]]:
+        """Retrieve full metadata for many mangas using the multi-id "/manga" endpoint.
+        Ids are requested in chunks of BATCH_SIZE, so a library costs one request per chunk instead of one per manga.
+        Failures are reported per id instead of failing the whole batch.
 
-        cover_art = Image.open(BytesIO(api_response.content)).convert("RGB")
+        Args:
+            id_tokens (list[str]): Identification tokens of the mangas on MangaDex.
 
-        return MangaMetadata(
-            provider=MangaDex.PROVIDER_NAME,
-            id_token=self.id_token,
-            titles=MangaDex.__extract_titles_from_response(manga_info),
-            tags=MangaDex.__extract_tags_from_response(manga_info),
-            genres=MangaDex.__extract_genres_from_response(manga_info),
-            summary=MangaDex.__extract_summary_from_response(manga_info),
-            cover_art=cover_art
-        )
+        Returns:
+            tuple[dict[str, MangaMetadata], dict[str, ProviderExceptions]]: Metadata and errors, both keyed by id_token.
+        """
+        results = {}
+        errors = {}
+
+        # Dropping duplicates while keeping the order.
+        id_tokens = list(dict.fromkeys(id_tokens))
+
+        for start in range(0, len(id_tokens), MangaDex.BATCH_SIZE):
+            chunk = id_tokens[start:start + MangaDex.BATCH_SIZE]
+
+            try:
+                manga_infos = MangaDex.__get_manga_info_many(chunk)
+
+            except ProviderExceptions as e:
+                for id_token in chunk:
+                    errors[id_token] = e
+                continue
+
+            for id_token in chunk:
+                if(id_token not in manga_infos):
+                    errors[id_token] = MangaNotFoundError("Manga was not returned by the batch request.", MangaDex.PROVIDER_NAME)
+                    continue
+
+                try:
+                    results[id_token] = MangaDex.metadata_from_response(id_token, manga_infos[id_token])
+
+                except ProviderExceptions as e:
+                    errors[id_token] = e
+
+        return results, errors
 
     @staticmethod
-    def search_manga(name: str) -> list[str]:
+    def search_manga(name: str, local_first:bool = False) -> list[str]:
+        """Query the site and get matched mangas identification token.
+
+        Args:
+            name (str): Name of manga to be queried.
+            local_first (bool, optional): Query the local catalog first (see Provider.set_catalog), the site is only queried if it has no match. Defaults to False.
+
+        Returns:
+            list[str]: list of identification tokens.
+        """
+        if(local_first and MangaDex.catalog is not None):
+            local_results = MangaDex.catalog.search(MangaDex.PROVIDER_NAME, name)
+
+            if(local_results):
+                return local_results
+
+        query = MangaDex.normalize_query(name)
+        cache_key = MangaDex.search_cache_key(query)
+        cached_results = MangaDex.get_cached_search(cache_key)
+
+        if(cached_results is not None):
+            return cached_results
+
         try:
-            api_response:Response = requests.get(
+            api_response:Response = MangaDex.get_transport().get(
                 f"{MangaDex.BASE_URL}/manga",
-                params={"title": name,
-                        "order[relevance]":"desc"
+                params={"title": query,
+                        "order[relevance]":"desc",
+                        "includes[]": ["cover_art"]
                     }
             )
 
+        except ProviderExceptions:
+            # Already explains the failure, e.g. an open circuit or exhausted retries.
+            raise
+
         except Exception as e:
             raise ProviderExceptions(e, MangaDex.PROVIDER_NAME)
         
@@ -62,8 +124,64 @@ class MangaDex(Provider):
             #Failed API request.
             raise ProviderExceptions(f"API response for 'search_manga' was ({api_response.status_code}).", MangaDex.PROVIDER_NAME)
         
+        cache = MangaDex.get_cache()
+        results = []
+
+        for manga in api_response.json()["data"]:
+            results.append(manga["id"])
+            # Search results carry the same attributes as "/manga/{id}?includes[]=cover_art", so fetching them is free.
+            cache.set(MangaDex.cache_key(manga["id"]), cache.build_entry({"data": manga}))
+
+        MangaDex.set_cached_search(cache_key, results)
+
+        return results
+
+    @staticmethod
+    def search_candidates(name:str, local_first:bool = False) -> list[SearchCandidate]:
+        """search_manga returning SearchCandidate. Candidates whose search result is still cached are complete,
+        they are built from it and promoted to MangaMetadata without a request.
+
+        Args:
+            name (str): Name of manga to be queried.
+            local_first (bool, optional): Query the local catalog first, see search_manga. Defaults to False.
 
-        return [manga["id"] for manga in api_response.json()["data"]]
+        Returns:
+            list[SearchCandidate]: Matched mangas, most relevant first.
+        """
+        cache = MangaDex.get_cache()
+        candidates = []
+
+        for id_token in MangaDex.search_manga(name, local_first):
+            entry = cache.get(MangaDex.cache_key(id_token))
+            metadata = None
+
+            # Missing when found in the local catalog or evicted from the cache, stale entries are not served as complete.
+            if(entry is not None and entry.is_fresh()):
+                try:
+                    metadata = MangaDex.metadata_from_response(id_token, entry.body)
+
+                except ProviderExceptions:
+                    # e.g. no english title or no cover art, the candidate is still offered like search_manga does.
+                    pass
+
+            if(metadata is None):
+                candidates.append(SearchCandidate(
+                    MangaDex.PROVIDER_NAME, id_token, None, loader=lambda id_token=id_token: MangaDex(id_token).get_metadata()
+                ))
+                continue
+
+            candidates.append(SearchCandidate(
+                MangaDex.PROVIDER_NAME,
+                id_token,
+                metadata.titles,
+                summary=metadata.summary,
+                genres=metadata.genres,
+                cover_url=metadata.cover_art.url,
+                complete=True,
+                loader=lambda metadata=metadata: metadata
+            ))
+
+        return candidates
         
     @staticmethod
     def get_titles(id_token: str) -> list[dict]:
@@ -90,32 +208,160 @@ class MangaDex(Provider):
         return MangaDex.__extract_summary_from_response(manga_info)
 
     @staticmethod
-    def get_cover(id_token: str) -> Image.Image:
+    def get_cover(id_token: str) -> "Image.Image":
 
         manga_info = MangaDex.__get_manga_info(id_token)
 
         filename = MangaDex.__extract_filename_from_response(manga_info)
 
-        api_response = requests.get(
-            f"https://uploads.mangadex.org/covers/{id_token}/{filename}"
+        return MangaDex.__get_cover_from_url(
+            f"{MangaDex.COVERS_URL}/{id_token}/{filename}"
         )
-
-        if(api_response.status_code != 200):
-            raise ProviderExceptions("Invalid cover URL. {https://uploads.mangadex.org/covers/{id_token}/{filename}")
-
-        return Image.open(BytesIO(api_response.content)).convert("RGB")
     
     @staticmethod
     def __get_manga_info(id_token) -> dict:
-        api_response:Response = requests.get(
+        return MangaDex.cached_get_json(
+            id_token,
             f"{MangaDex.BASE_URL}/manga/{id_token}?includes[]=cover_art"
         )
+    
+    @staticmethod
+    def __get_manga_info_many(id_tokens:list[str]) -> dict[str, dict]:
+        """Request up to BATCH_SIZE mangas at once, mangas with a fresh cache entry are not requested again.
+        Every item is wrapped as {"data": item} so it has the same shape as a "__get_manga_info" response.
+        """
+        cache = MangaDex.get_cache()
+        manga_infos = {}
+
+        for id_token in id_tokens:
+            entry = cache.get(MangaDex.cache_key(id_token))
+
+            if(entry is not None and entry.is_fresh()):
+                manga_infos[id_token] = entry.body
+
+        id_tokens = [id_token for id_token in id_tokens if id_token not in manga_infos]
+
+        MangaDex.record_cache_lookup("hit", len(manga_infos))
+        MangaDex.record_cache_lookup("miss", len(id_tokens))
+
+        if(not id_tokens):
+            return manga_infos
+
+        try:
+            api_response:Response = MangaDex.get_transport().get(
+                f"{MangaDex.BASE_URL}/manga",
+                params={"ids[]": id_tokens,
+                        "includes[]": ["cover_art"],
+                        # All ratings, otherwise the default filter silently drops some of the requested ids.
+                        "contentRating[]": MangaDex.CONTENT_RATINGS,
+                        "limit": len(id_tokens)
+                    }
+            )
+
+        except ProviderExceptions:
+            # Already explains the failure, e.g. an open circuit or exhausted retries.
+            raise
+
+        except Exception as e:
+            raise ProviderExceptions(e, MangaDex.PROVIDER_NAME)
 
         if(api_response.status_code != 200):
-            raise MangaNotFoundError(f"API response for '__get_manga_info' was ({api_response.status_code}).", MangaDex.PROVIDER_NAME)
+            raise ProviderExceptions(f"API response for '__get_manga_info_many' was ({api_response.status_code}).", MangaDex.PROVIDER_NAME)
+
+        for manga in api_response.json()["data"]:
+            manga_infos[manga["id"]] = {"data": manga}
+            cache.set(MangaDex.cache_key(manga["id"]), cache.build_entry(manga_infos[manga["id"]]))
+
+        return manga_infos
+
+    @staticmethod
+    def metadata_from_response(id_token:str, manga_info:dict) -> MangaMetadata:
+        """Build MangaMetadata from a "/manga/{id}?includes[]=cover_art" response body.
+        The cover art is not downloaded until it is accessed.
+
+        Args:
+            id_token (str): Used to uniquely identify the manga on the provider site.
+            manga_info (dict): API response body.
+
+        Returns:
+            MangaMetadata: Metadata of the manga.
+        """
+        filename = MangaDex.__extract_filename_from_response(manga_info)
+
+        # Only downloaded when the cover is accessed.
+        cover_art = CoverArt(
+            f"{MangaDex.COVERS_URL}/{id_token}/{filename}",
+            fetcher=MangaDex.__download_cover
+        )
+
+        metadata = MangaMetadata(
+            provider=MangaDex.PROVIDER_NAME,
+            id_token=id_token,
+            titles=MangaDex.__extract_titles_from_response(manga_info),
+            tags=MangaDex.__extract_tags_from_response(manga_info),
+            genres=MangaDex.__extract_genres_from_response(manga_info),
+            summary=MangaDex.__extract_summary_from_response(manga_info),
+            cover_art=cover_art
+        )
+
+        if(MangaDex.catalog is not None):
+            MangaDex.catalog.add_metadata(metadata, manga_info["data"]["attributes"].get("updatedAt", "")[:19] or None)
+
+        return metadata
+
+    @staticmethod
+    def iter_updated_since(since:str):
+        """Yield (id_token, titles, updated_at) of every manga updated since the given time, oldest first.
+
+        Args:
+            since (str): Time as "YYYY-MM-DDTHH:MM:SS".
+        """
+        offset = 0
+
+        while(True):
+            try:
+                api_response:Response = MangaDex.get_transport().get(
+                    f"{MangaDex.BASE_URL}/manga",
+                    params={"updatedAtSince": since,
+                            "order[updatedAt]": "asc",
+                            "contentRating[]": MangaDex.CONTENT_RATINGS,
+                            "limit": MangaDex.BATCH_SIZE,
+                            "offset": offset
+                        }
+                )
+
+            except ProviderExceptions:
+                # Already explains the failure, e.g. an open circuit or exhausted retries.
+                raise
+
+            except Exception as e:
+                raise ProviderExceptions(e, MangaDex.PROVIDER_NAME)
+
+            if(api_response.status_code != 200):
+                raise ProviderExceptions(f"API response for 'iter_updated_since' was ({api_response.status_code}).", MangaDex.PROVIDER_NAME)
+
+            mangas = api_response.json()["data"]
+
+            for manga in mangas:
+                try:
+                    titles = MangaDex.__extract_titles_from_response({"data": manga})
+
+                except ProviderExceptions:
+                    #No english title.
+                    continue
+
+                yield manga["id"], titles, manga["attributes"]["updatedAt"][:19]
+
+            if(len(mangas) < MangaDex.BATCH_SIZE):
+                break
+
+            offset += MangaDex.BATCH_SIZE
+
+            if(offset + MangaDex.BATCH_SIZE > MangaDex.MAX_LIST_OFFSET):
+                # The list endpoint stops at MAX_LIST_OFFSET results, continue from the newest seen time instead.
+                since = mangas[-1]["attributes"]["updatedAt"][:19]
+                offset = 0
 
-        return api_response.json()
-    
     @staticmethod
     def __extract_titles_from_response(response:dict) -> list[dict]:
         titles_dict = {}
@@ -193,6 +439,20 @@ class MangaDex(Provider):
             raise ProviderExceptions(f"Could not extract cover filename from response. Maybe no cover art?", MangaDex.PROVIDER_NAME)
         
         return filename
-        
-        
 
+    @staticmethod
+    def __get_cover_from_url(url:str) -> "Image.Image":
+        from PIL import Image
+
+        return Image.open(BytesIO(MangaDex.__download_cover(url))).convert("RGB")
+
+    @staticmethod
+    def __download_cover(url:str) -> bytes:
+        try:
+            return MangaDex.get_transport().download(url, max_bytes=MangaDex.MAX_COVER_DOWNLOAD_BYTES)
+
+        except ProviderExceptions:
+            raise
+
+        except Exception as e:
+            raise ProviderExceptions(e, MangaDex.PROVIDER_NAME)
@@ -1,11 +1,16 @@
 from .provider import Provider
 from .provider_exceptions import *
 from .manga_metadata import MangaMetadata
+from .cover_art import CoverArt
+from .search_candidate import SearchCandidate
 
-import requests
 from requests import Response
-from PIL import Image
 from io import BytesIO
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Only imported when cover art is decoded.
+    from PIL import Image
 
 class MangaUpdates(Provider):
     """Provider class implementation for MangaDex website.
@@ -27,13 +32,29 @@ class MangaUpdates(Provider):
     def get_metadata(self) -> MangaMetadata:
         manga_info = MangaUpdates.__get_manga_info(self.id_token)
 
-        cover_art = MangaUpdates.__get_cover_from_url(
-            manga_info["image"]["url"]["original"]
+        return MangaUpdates.metadata_from_response(self.id_token, manga_info)
+
+    @staticmethod
+    def metadata_from_response(id_token:str, manga_info:dict) -> MangaMetadata:
+        """Build MangaMetadata from a "/v1/series/{id}" response body.
+        The cover art is not downloaded until it is accessed.
+
+        Args:
+            id_token (str): Used to uniquely identify the manga on the provider site.
+            manga_info (dict): API response body.
+
+        Returns:
+            MangaMetadata: Metadata of the manga.
+        """
+        # Only downloaded when the cover is accessed.
+        cover_art = CoverArt(
+            manga_info["image"]["url"]["original"],
+            fetcher=MangaUpdates.__download_cover
         )
 
-        return MangaMetadata(
+        metadata = MangaMetadata(
             provider=MangaUpdates.PROVIDER_NAME,
-            id_token=self.id_token,
+            id_token=id_token,
             titles=MangaUpdates.__extract_titles_from_response(manga_info),
             tags=MangaUpdates.__extract_tags_from_response(manga_info),
             genres=MangaUpdates.__extract_genres_from_response(manga_info),
@@ -41,37 +62,99 @@ class MangaUpdates(Provider):
             cover_art=cover_art
         )
 
+        if(MangaUpdates.catalog is not None):
+            MangaUpdates.catalog.add_metadata(metadata)
+
+        return metadata
+
     @staticmethod
-    def search_manga(name: str, page_limit:int = 1, per_page_limit:int = 10) -> list[str]:
+    def search_manga(name: str, page_limit:int = 1, per_page_limit:int = 10, local_first:bool = False) -> list[str]:
         """Query the site and get matched mangas identification token.
 
         Args:
             name (str): Name of manga to be queried.
             page_limit (int, optional): Limit pages returned by MangaUpdates. Defaults to 1.
             per_page_limit (int, optional): Limit mangas per page returned by MangaUpdates. Defaults to 10.
+            local_first (bool, optional): Query the local catalog first (see Provider.set_catalog), the site is only queried if it has no match. Defaults to False.
 
         Returns:
             list[str]: list of identification tokens.
         """
+        if(local_first and MangaUpdates.catalog is not None):
+            local_results = MangaUpdates.catalog.search(MangaUpdates.PROVIDER_NAME, name, limit=per_page_limit)
+
+            if(local_results):
+                return local_results
+
+        return [record["series_id"] for record in MangaUpdates.__search_records(name, page_limit, per_page_limit)]
+
+    @staticmethod
+    def search_candidates(name:str, page_limit:int = 1, per_page_limit:int = 10, local_first:bool = False) -> list[SearchCandidate]:
+        """search_manga returning SearchCandidate filled from the search records (summary, genres and cover URL).
+        Search records lack the associated titles and categories, so the candidates are not complete and their titles are left None:
+        a series known under an associated title could not be matched, select_candidate promotes them before matching instead.
+
+        Returns:
+            list[SearchCandidate]: Matched mangas, most relevant first.
+        """
+        if(local_first and MangaUpdates.catalog is not None):
+            local_results = MangaUpdates.catalog.search(MangaUpdates.PROVIDER_NAME, name, limit=per_page_limit)
+
+            if(local_results):
+                return [
+                    SearchCandidate(MangaUpdates.PROVIDER_NAME, id_token, None, loader=lambda id_token=id_token: MangaUpdates(id_token).get_metadata())
+                    for id_token in local_results
+                ]
+
+        candidates = []
+        for record in MangaUpdates.__search_records(name, page_limit, per_page_limit):
+            candidates.append(SearchCandidate(
+                MangaUpdates.PROVIDER_NAME,
+                record["series_id"],
+                None,
+                summary=record.get("description"),
+                genres=[genre["genre"] for genre in record.get("genres", [])],
+                cover_url=record.get("image", {}).get("url", {}).get("original"),
+                loader=lambda id_token=record["series_id"]: MangaUpdates(id_token).get_metadata()
+            ))
+
+        return candidates
+
+    @staticmethod
+    def __search_records(name:str, page_limit:int, per_page_limit:int) -> list[dict]:
+        """Records of the search results, through the search cache."""
+        query = MangaUpdates.normalize_query(name)
+        cache_key = MangaUpdates.search_cache_key(query, page_limit=page_limit, per_page_limit=per_page_limit, payload="records")
+        cached_results = MangaUpdates.get_cached_search(cache_key)
+
+        if(cached_results is not None):
+            return cached_results
+
         try:
-            api_response:Response = requests.post(
+            api_response:Response = MangaUpdates.get_transport().post(
                 f"{MangaUpdates.BASE_URL}/v1/series/search",
                 json={
-                    "search": name,
+                    "search": query,
                     "page": page_limit,
                     "perpage": per_page_limit
                 }
             )
 
+        except ProviderExceptions:
+            # Already explains the failure, e.g. an open circuit or exhausted retries.
+            raise
+
         except Exception as e:
             raise ProviderExceptions(e, MangaUpdates.PROVIDER_NAME)
         
         if(api_response.status_code != 200):
             #Failed API request.
             raise ProviderExceptions(f"API response for 'search_manga' was ({api_response.status_code}).", MangaUpdates.PROVIDER_NAME)
-        
 
-        return [manga["record"]["series_id"] for manga in api_response.json()["results"]]
+        results = [manga["record"] for manga in api_response.json()["results"]]
+        MangaUpdates.set_cached_search(cache_key, results)
+
+        return results
         
     @staticmethod
     def get_titles(id_token: str) -> list[dict]:
@@ -98,7 +181,7 @@ class MangaUpdates(Provider):
         return MangaUpdates.__extract_summary_from_response(manga_info)
 
     @staticmethod
-    def get_cover(id_token: str) -> Image.Image:
+    def get_cover(id_token: str) -> "Image.Image":
 
         manga_info = MangaUpdates.__get_manga_info(id_token)
 
@@ -108,14 +191,10 @@ class MangaUpdates(Provider):
     
     @staticmethod
     def __get_manga_info(id_token) -> dict:
-        api_response:Response = requests.get(
+        return MangaUpdates.cached_get_json(
+            id_token,
             f"{MangaUpdates.BASE_URL}/v1/series/{id_token}"
         )
-
-        if(api_response.status_code != 200):
-            raise MangaNotFoundError(f"API response for '__get_manga_info' was ({api_response.status_code}).", MangaUpdates.PROVIDER_NAME)
-
-        return api_response.json()
     
     @staticmethod
     def __extract_titles_from_response(response:dict) -> list[dict]:
@@ -177,13 +256,21 @@ class MangaUpdates(Provider):
             raise ProviderExceptions(f"Could not extract summary from response. ({e})", MangaUpdates.PROVIDER_NAME)
         
     @staticmethod
-    def __get_cover_from_url(url:str) -> Image.Image:
-        api_response = requests.get(url)
+    def __get_cover_from_url(url:str) -> "Image.Image":
+        from PIL import Image
 
-        if(api_response.status_code != 200):
-            raise ProviderExceptions(f"Invalid cover URL. {url}")
+        return Image.open(BytesIO(MangaUpdates.__download_cover(url))).convert("RGB")
+
+    @staticmethod
+    def __download_cover(url:str) -> bytes:
+        try:
+            return MangaUpdates.get_transport().download(url, max_bytes=MangaUpdates.MAX_COVER_DOWNLOAD_BYTES)
+
+        except ProviderExceptions:
+            raise
 
-        return Image.open(BytesIO(api_response.content)).convert("RGB")
+        except Exception as e:
+            raise ProviderExceptions(e, MangaUpdates.PROVIDER_NAME)
         
         
 
@@ -0,0 +1,228 @@
+import bisect
+import cProfile
+import pstats
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Histogram():
+    """Cumulative histogram of observed values, with the same buckets as a Prometheus histogram."""
+
+    def __init__(self, buckets:tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last one is +Inf.
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value:float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry():
+    """Counters and histograms recorded around the HTTP calls and CPU heavy steps of the providers and Komga.
+    Metrics are identified by name and labels, e.g. inc("http_retries_total", service="MangaDex").
+
+    Hooks are called with (kind, name, value, labels) for every recorded value, kind being "counter" or "histogram",
+    so the metrics can also be forwarded elsewhere (logs, StatsD, ...).
+
+    Values recorded in other processes (e.g. cover encoding in a ProcessPoolExecutor) are not collected.
+    """
+
+    # Seconds
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    __shared = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, buckets:tuple[float, ...] = None) -> None:
+        """
+        Args:
+            buckets (tuple[float, ...], optional): Upper bounds of the histogram buckets. Defaults to DEFAULT_BUCKETS.
+        """
+        self.buckets = tuple(buckets) if buckets is not None else MetricsRegistry.DEFAULT_BUCKETS
+        self.hooks = []
+        self.__counters = defaultdict(float)
+        self.__histograms = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def shared() -> "MetricsRegistry":
+        """Process wide registry, used by every instrumented call."""
+        if(MetricsRegistry.__shared is None):
+            with MetricsRegistry.__shared_lock:
+                if(MetricsRegistry.__shared is None):
+                    MetricsRegistry.__shared = MetricsRegistry()
+
+        return MetricsRegistry.__shared
+
+    def add_hook(self, hook) -> None:
+        """
+        Args:
+            hook (Callable[[str, str, float, dict], None]): Called with (kind, name, value, labels).
+        """
+        self.hooks.append(hook)
+
+    def inc(self, name:str, value:float = 1, **labels) -> None:
+        key = (name, MetricsRegistry.__labels_key(labels))
+
+        with self.__lock:
+            self.__counters[key] += value
+
+        self.__call_hooks("counter", name, value, labels)
+
+    def observe(self, name:str, value:float, **labels) -> None:
+        key = (name, MetricsRegistry.__labels_key(labels))
+
+        with self.__lock:
+            if(key not in self.__histograms):
+                self.__histograms[key] = Histogram(self.buckets)
+
+            self.__histograms[key].observe(value)
+
+        self.__call_hooks("histogram", name, value, labels)
+
+    @contextmanager
+    def time(self, name:str, **labels):
+        """Observe the seconds spent in the with block, also when it raises."""
+        start = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_request(self, service:str, method:str, status:int, seconds:float, bytes_in:int, bytes_out:int) -> None:
+        """Record one HTTP request, used by every HTTP client of the project."""
+        labels = {"service": service, "method": method}
+
+        self.inc("http_requests_total", status=str(status), **labels)
+        self.observe("http_request_seconds", seconds, **labels)
+        self.inc("http_received_bytes_total", bytes_in, **labels)
+        self.inc("http_sent_bytes_total", bytes_out, **labels)
+
+    def response_hook(self, service:str):
+        """requests response hook recording every response of a session, e.g.
+        session.hooks["response"].append(MetricsRegistry.shared().response_hook("Komga")).
+        """
+        def hook(response, *args, **kwargs) -> None:
+            body = response.request.body
+
+            self.record_request(
+                service,
+                response.request.method,
+                response.status_code,
+                response.elapsed.total_seconds(),
+                int(response.headers.get("Content-Length", 0)),
+                len(body) if body is not None else 0
+            )
+
+        return hook
+
+    def counter(self, name:str, **labels) -> float:
+        with self.__lock:
+            return self.__counters.get((name, MetricsRegistry.__labels_key(labels)), 0)
+
+    def histogram(self, name:str, **labels) -> Histogram:
+        with self.__lock:
+            return self.__histograms.get((name, MetricsRegistry.__labels_key(labels)))
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__counters.clear()
+            self.__histograms.clear()
+
+    def to_prometheus(self) -> str:
+        """Dump every metric in the Prometheus text exposition format."""
+        lines = []
+
+        with self.__lock:
+            counters = sorted(self.__counters.items())
+            histograms = sorted(self.__histograms.items(), key=lambda item: item[0])
+
+            histogram_lines = []
+            for (name, labels), histogram in histograms:
+                cumulative = 0
+                for upper_bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    histogram_lines.append((name, f"{name}_bucket{MetricsRegistry.__format_labels(labels + (('le', str(upper_bound)),))} {cumulative}"))
+
+                histogram_lines.append((name, f"{name}_sum{MetricsRegistry.__format_labels(labels)} {histogram.sum}"))
+                histogram_lines.append((name, f"{name}_count{MetricsRegistry.__format_labels(labels)} {histogram.count}"))
+
+        declared = set()
+        for (name, labels), value in counters:
+            if(name not in declared):
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+
+            lines.append(f"{name}{MetricsRegistry.__format_labels(labels)} {int(value) if value.is_integer() else value}")
+
+        for name, line in histogram_lines:
+            if(name not in declared):
+                declared.add(name)
+                lines.append(f"# TYPE {name} histogram")
+
+            lines.append(line)
+
+        return "\n".join(lines) + "\n"
+
+    def __call_hooks(self, kind:str, name:str, value:float, labels:dict) -> None:
+        for hook in self.hooks:
+            hook(kind, name, value, labels)
+
+    @staticmethod
+    def __labels_key(labels:dict) -> tuple:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @staticmethod
+    def __format_labels(labels:tuple) -> str:
+        if(not labels):
+            return ""
+
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+@contextmanager
+def profiled(output_path:str = None, sort_by:str = "cumulative", limit:int = 30):
+    """Run the with block under cProfile, threads started in the block included (e.g. the sync pipeline stages).
+    The stats are saved to output_path (readable with pstats or snakeviz), or the top functions are printed.
+    """
+    profilers = [cProfile.Profile()]
+    # From Python 3.12 cProfile is built on sys.monitoring and one profiler already sees every thread.
+    per_thread = sys.version_info < (3, 12)
+
+    def start_thread_profiler(*args) -> None:
+        # First profile event of a new thread, replaces itself by a profiler for that thread.
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+
+    if(per_thread):
+        threading.setprofile(start_thread_profiler)
+
+    profilers[0].enable()
+
+    try:
+        yield profilers[0]
+
+    finally:
+        profilers[0].disable()
+
+        if(per_thread):
+            threading.setprofile(None)
+
+        stats = pstats.Stats(*profilers)
+
+        if(output_path is not None):
+            stats.dump_stats(output_path)
+
+        else:
+            stats.sort_stats(sort_by).print_stats(limit)
@@ -1,13 +1,267 @@
 import abc
+import re
+import threading
 from abc import ABC, abstractmethod
-from PIL import Image
+from typing import TYPE_CHECKING
 
+from .cache import ResponseCache, MemoryCache
+from .transport import HttpTransport
+from .catalog import LocalCatalog
+from .provider_exceptions import ProviderExceptions, MangaNotFoundError
+from .manga_metadata import MangaMetadata
+from .search_candidate import SearchCandidate
+from .metrics import MetricsRegistry
+
+if TYPE_CHECKING:
+    # Only imported when cover art is decoded.
+    from PIL import Image
 
 
 class Provider(ABC):
     """Abstract class for metadata providers.
 
     """
+    PROVIDER_NAME = None
+
+    # Shared by all providers unless a provider sets its own, keys are prefixed with PROVIDER_NAME.
+    cache: ResponseCache = None
+
+    # Every provider gets its own connection pool.
+    transport: HttpTransport = None
+    __transport_lock = threading.Lock()
+
+    # Offline title index, populated from responses when set.
+    catalog: LocalCatalog = None
+
+    # Cover downloads are streamed and aborted past this size.
+    MAX_COVER_DOWNLOAD_BYTES = 20 * 1024 * 1024
+
+    # Seconds search results are cached, searches without results have their own TTL
+    # so known missing titles cost no request but are still retried eventually.
+    SEARCH_HIT_TTL = 86400
+    SEARCH_MISS_TTL = 6 * 3600
+
+    # Volume or chapter suffixes, e.g. "Title Vol. 3", "Title v03", "Title #12".
+    __VOLUME_SUFFIX = re.compile(r"(?:\b(?:vol(?:ume)?|v|tome|chapter|ch)\.?\s*\d+(?:\.\d+)?|#\s*\d+)\s*$")
+
+    @classmethod
+    def set_catalog(cls, catalog:LocalCatalog) -> None:
+        """Index every fetched manga in catalog and let search_manga(local_first=True) query it.
+        Calling it on Provider sets it for every provider.
+        """
+        cls.catalog = catalog
+
+    @classmethod
+    def search_candidates(cls, name:str) -> list[SearchCandidate]:
+        """Query the site and get the matched mangas as SearchCandidate.
+        Providers whose search response carries the manga attributes override it to fill the candidates from it,
+        by default the candidates only hold the identification token.
+
+        Args:
+            name (str): Name of manga to be queried.
+
+        Returns:
+            list[SearchCandidate]: Matched mangas, most relevant first.
+        """
+        return [
+            SearchCandidate(cls.PROVIDER_NAME, id_token, None, loader=lambda id_token=id_token: cls(id_token).get_metadata())
+            for id_token in cls.search_manga(name)
+        ]
+
+    @classmethod
+    def promote_candidates(cls, candidates:list[SearchCandidate]) -> list[MangaMetadata]:
+        """MangaMetadata of every candidate, in order. Complete candidates cost no request,
+        the others are requested in batches if the provider supports it (get_metadata_many).
+        Candidates that could not be retrieved are left out.
+        """
+        id_tokens = [candidate.id_token for candidate in candidates if not candidate.complete]
+        fetched = {}
+
+        if(id_tokens and hasattr(cls, "get_metadata_many")):
+            fetched, _ = cls.get_metadata_many(id_tokens)
+
+        metadata_list = []
+        for candidate in candidates:
+            try:
+                if(candidate.complete or not hasattr(cls, "get_metadata_many")):
+                    metadata_list.append(candidate.to_metadata())
+
+                elif(candidate.id_token in fetched):
+                    metadata_list.append(fetched[candidate.id_token])
+
+            except ProviderExceptions:
+                continue
+
+        return metadata_list
+
+    @classmethod
+    def select_candidate(cls, name:str, candidates:list[SearchCandidate], match_policy = None) -> MangaMetadata:
+        """Pick a candidate by its titles and promote only that one.
+        Candidates without titles (searches returning identification tokens only) are promoted first so they can be compared.
+
+        Args:
+            name (str): Name the candidates were searched with.
+            candidates (list[SearchCandidate]): Search results, most relevant first.
+            match_policy (Callable[[str, list], object], optional): Picks a candidate by its titles, None if none fits.
+                Defaults to the first candidate.
+
+        Returns:
+            MangaMetadata: Metadata of the chosen candidate, None if none was chosen or it could not be retrieved.
+        """
+        if(match_policy is None):
+            # Only the first candidate can be chosen, the others are never requested.
+            candidates = candidates[:1]
+
+        untitled = [candidate for candidate in candidates if candidate.titles is None]
+
+        if(untitled):
+            promoted = {metadata.id_token: metadata for metadata in cls.promote_candidates(untitled)}
+            candidates = [
+                promoted.get(candidate.id_token, candidate) for candidate in candidates
+                if candidate.titles is not None or candidate.id_token in promoted
+            ]
+
+        if(match_policy is None):
+            chosen = candidates[0] if candidates else None
+
+        else:
+            chosen = match_policy(name, candidates)
+
+        # Candidates promoted to be compared are not requested again.
+        if(chosen is None or isinstance(chosen, MangaMetadata)):
+            return chosen
+
+        promoted = cls.promote_candidates([chosen])
+
+        return promoted[0] if promoted else None
+
+    @classmethod
+    def get_transport(cls) -> HttpTransport:
+        """Get the HTTP transport of the provider, a default one is created on first use.
+        """
+        if(cls.__dict__.get("transport") is None):
+            with Provider.__transport_lock:
+                if(cls.__dict__.get("transport") is None):
+                    cls.transport = HttpTransport(name=cls.PROVIDER_NAME)
+
+        return cls.transport
+
+    @classmethod
+    def set_transport(cls, transport:HttpTransport) -> None:
+        """Replace the HTTP transport of the provider, e.g. to change the pool size, timeout or headers.
+        """
+        cls.transport = transport
+
+    @classmethod
+    def get_cache(cls) -> ResponseCache:
+        """Get the response cache used by the provider, an in-memory LRU cache is created on first use.
+        """
+        if(cls.cache is None):
+            Provider.cache = MemoryCache()
+
+        return cls.cache
+
+    @classmethod
+    def set_cache(cls, cache:ResponseCache) -> None:
+        """Replace the response cache, e.g. with SQLiteCache to keep responses across runs.
+        Calling it on Provider sets it for every provider without a cache of its own.
+        """
+        cls.cache = cache
+
+    @classmethod
+    def cache_key(cls, id_token:str) -> str:
+        return f"{cls.PROVIDER_NAME}:{id_token}"
+
+    @staticmethod
+    def normalize_query(name:str) -> str:
+        """Search query sent to the providers and used in search cache keys: casefolded, without punctuation and volume suffix.
+        Names differing only by these share one request and one cache entry.
+        """
+        query = " ".join(re.sub(r"[^\w#.]+|_", " ", name.casefold()).split())
+        query = Provider.__VOLUME_SUFFIX.sub("", query)
+        normalized = " ".join(re.sub(r"[\W_]+", " ", query).split())
+
+        # Nothing but a volume suffix, e.g. "Vol. 3".
+        return normalized or " ".join(name.casefold().split())
+
+    @classmethod
+    def search_cache_key(cls, query:str, **params) -> str:
+        """Cache key of a search, query being the query as sent (see normalize_query)
+        and params the search parameters changing its results (e.g. per_page_limit).
+        """
+        parameters = ",".join(f"{key}={value}" for key, value in sorted(params.items()))
+
+        return f"{cls.PROVIDER_NAME}:search:{query}:{parameters}"
+
+    @classmethod
+    def get_cached_search(cls, key:str) -> list:
+        """Fresh cached results of a search, None if it has to be sent. Empty results are cached too."""
+        entry = cls.get_cache().get(key)
+
+        if(entry is not None and entry.is_fresh()):
+            cls.record_cache_lookup("hit", kind="search")
+            return list(entry.body["results"])
+
+        cls.record_cache_lookup("miss", kind="search")
+
+        return None
+
+    @classmethod
+    def set_cached_search(cls, key:str, results:list) -> None:
+        cache = cls.get_cache()
+        cache.set(key, cache.build_entry({"results": results}, ttl=cls.SEARCH_HIT_TTL if results else cls.SEARCH_MISS_TTL))
+
+    @classmethod
+    def record_cache_lookup(cls, result:str, count:int = 1, kind:str = "manga") -> None:
+        """Count cache lookups in MetricsRegistry.shared(), result being "hit", "revalidated" or "miss"."""
+        MetricsRegistry.shared().inc("cache_lookups_total", count, provider=cls.PROVIDER_NAME, kind=kind, result=result)
+
+    @classmethod
+    def cached_get_json(cls, id_token:str, url:str) -> dict:
+        """GET the JSON of one manga through the provider cache.
+        Fresh entries are returned without a request, stale ones are revalidated using ETag/Last-Modified.
+        Raise ProviderExceptions.MangaNotFoundError if the API response is not successful.
+
+        Args:
+            id_token (str): Used to uniquely identify the manga on the provider site.
+            url (str): API URL of the manga.
+
+        Returns:
+            dict: API response body.
+        """
+        cache = cls.get_cache()
+        key = cls.cache_key(id_token)
+        entry = cache.get(key)
+
+        if(entry is not None and entry.is_fresh()):
+            cls.record_cache_lookup("hit")
+            return entry.body
+
+        api_response = cls.get_transport().get(
+            url,
+            headers=entry.revalidation_headers() if entry is not None else {}
+        )
+
+        if(api_response.status_code == 304 and entry is not None):
+            #Not modified; the stale entry is still valid.
+            cls.record_cache_lookup("revalidated")
+            cache.set(key, entry.refreshed(cache.ttl))
+            return entry.body
+
+        cls.record_cache_lookup("miss")
+
+        if(api_response.status_code >= 500):
+            # Still failing after the transport's retries, the manga may well exist.
+            raise ProviderExceptions(f"API response for '__get_manga_info' was ({api_response.status_code}).", cls.PROVIDER_NAME)
+
+        if(api_response.status_code != 200):
+            raise MangaNotFoundError(f"API response for '__get_manga_info' was ({api_response.status_code}).", cls.PROVIDER_NAME)
+
+        body = api_response.json()
+        cache.set(key, cache.build_entry(body, api_response.headers))
+
+        return body
+
     @staticmethod
     @abstractmethod
     def search_manga(self, name:str) -> list[str]:
@@ -85,7 +339,7 @@ class Provider(ABC):
 
     @staticmethod
     @abstractmethod
-    def get_cover(self, id_token:str) -> Image.Image:
+    def get_cover(self, id_token:str) -> "Image.Image":
         """Get cover art of the specified manga.
         Raise ProviderExceptions.MangaNotFoundError if there is no matched manga or multiple mangas.
 
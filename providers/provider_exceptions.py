@@ -7,4 +7,22 @@ class MangaNotFoundError(ProviderExceptions):
     """Raise when the manga was not found or got multiple manga when using the id_token."""
 
     def __init__(self, message, provider_name) -> None:
-        super().__init__(message, provider_name)
\ No newline at end of file
+        super().__init__(message, provider_name)
+
+class RateLimitedError(ProviderExceptions):
+    """Raise when the provider keeps answering 429 (Too Many Requests) after all retries."""
+
+    def __init__(self, message, provider_name) -> None:
+        super().__init__(message, provider_name)
+
+class ResponseTooLargeError(ProviderExceptions):
+    """Raise when a download is bigger than the allowed size, e.g. an oversized cover art."""
+
+    def __init__(self, message, provider_name) -> None:
+        super().__init__(message, provider_name)
+
+class CircuitOpenError(ProviderExceptions):
+    """Raise when requests to the provider are refused without being sent, after too many consecutive failures."""
+
+    def __init__(self, message, provider_name) -> None:
+        super().__init__(message, provider_name)
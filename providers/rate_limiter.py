@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+
+class TokenBucket():
+    """Token bucket allowing `rate` requests per second with bursts of up to `burst` requests.
+    Tokens can go negative, which queues callers behind each other instead of letting them race.
+    """
+
+    def __init__(self, rate:float, burst:int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one token.
+
+        Returns:
+            float: Seconds to wait before the request may be sent.
+        """
+        with self.__lock:
+            self.__refill()
+            self.tokens -= 1
+
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def penalize(self, delay:float) -> None:
+        """Block the bucket for delay seconds, e.g. after a 429 response."""
+        with self.__lock:
+            self.__refill()
+            self.tokens = min(self.tokens, 0) - delay * self.rate
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter():
+    """Per-host request scheduler shared by all provider calls.
+    Hosts without a configured limit are not throttled, but still wait out the penalties of their 429 responses.
+    """
+
+    # requests per second, burst
+    DEFAULT_LIMITS = {
+        "api.mangadex.org": (5, 5),
+        "uploads.mangadex.org": (10, 10),
+        "api.mangaupdates.com": (2, 2)
+    }
+
+    __shared = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, limits:dict[str, tuple[float, int]] = None) -> None:
+        """
+        Args:
+            limits (dict[str, tuple[float, int]], optional): Host to (requests per second, burst). Defaults to DEFAULT_LIMITS.
+        """
+        self.limits = dict(RateLimiter.DEFAULT_LIMITS if limits is None else limits)
+        self.__buckets = {host: TokenBucket(rate, burst) for host, (rate, burst) in self.limits.items()}
+        # Host without a bucket: monotonic time until which its requests wait.
+        self.__penalties = {}
+        self.__waiting = defaultdict(int)
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def shared() -> "RateLimiter":
+        """Process wide limiter with DEFAULT_LIMITS, used by default by every transport."""
+        if(RateLimiter.__shared is None):
+            with RateLimiter.__shared_lock:
+                if(RateLimiter.__shared is None):
+                    RateLimiter.__shared = RateLimiter()
+
+        return RateLimiter.__shared
+
+    def set_limit(self, host:str, rate:float, burst:int = 1) -> None:
+        with self.__lock:
+            self.limits[host] = (rate, burst)
+            self.__buckets[host] = TokenBucket(rate, burst)
+
+    def acquire(self, url:str) -> None:
+        """Block until a request to url's host is permitted."""
+        host, delay = self.__reserve(url)
+
+        if(delay > 0):
+            with self.__waiting_on(host):
+                time.sleep(delay)
+
+    async def acquire_async(self, url:str) -> None:
+        """Wait, without blocking the event loop, until a request to url's host is permitted."""
+        host, delay = self.__reserve(url)
+
+        if(delay > 0):
+            with self.__waiting_on(host):
+                await asyncio.sleep(delay)
+
+    def penalize(self, url:str, delay:float) -> None:
+        """Stop sending requests to url's host for delay seconds."""
+        host = urlsplit(url).hostname
+        bucket = self.__buckets.get(host)
+
+        if(bucket is not None):
+            bucket.penalize(delay)
+            return
+
+        with self.__lock:
+            self.__penalties[host] = max(self.__penalties.get(host, 0), time.monotonic() + delay)
+
+    def queue_depth(self, host:str = None) -> int:
+        """Number of requests currently waiting for a token, for one host or all of them."""
+        with self.__lock:
+            if(host is not None):
+                return self.__waiting[host]
+
+            return sum(self.__waiting.values())
+
+    @staticmethod
+    def parse_retry_after(value:str, default:float) -> float:
+        """Parse a Retry-After header, given either in seconds or as an HTTP date."""
+        if(not value):
+            return default
+
+        try:
+            return max(0, float(value))
+
+        except ValueError:
+            pass
+
+        try:
+            return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+
+        except (TypeError, ValueError):
+            return default
+
+    def __reserve(self, url:str) -> tuple[str, float]:
+        host = urlsplit(url).hostname
+        bucket = self.__buckets.get(host)
+
+        if(bucket is not None):
+            return host, bucket.reserve()
+
+        with self.__lock:
+            penalized_until = self.__penalties.get(host)
+
+            if(penalized_until is None):
+                return host, 0
+
+            if(penalized_until <= time.monotonic()):
+                del self.__penalties[host]
+                return host, 0
+
+        return host, penalized_until - time.monotonic()
+
+    @contextmanager
+    def __waiting_on(self, host:str):
+        """Count the caller as queued for host while inside the with block."""
+        with self.__lock:
+            self.__waiting[host] += 1
+
+        try:
+            yield
+
+        finally:
+            with self.__lock:
+                self.__waiting[host] -= 1
@@ -0,0 +1,246 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .rate_limiter import RateLimiter
+from .metrics import MetricsRegistry
+
+
+class RetryPolicy():
+    """When and after how long a failed request is sent again.
+    Server errors (5xx), timeouts and connection errors are retried with a jittered exponential backoff,
+    the jitter spreads the retries of concurrent workers instead of sending them all at once.
+    """
+
+    RETRY_STATUSES = frozenset({500, 502, 503, 504})
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE"})
+
+    def __init__(self, max_retries:int = 3, backoff:float = 0.5, max_backoff:float = 30, methods:frozenset = None) -> None:
+        """
+        Args:
+            max_retries (int, optional): Retries after the first attempt. Defaults to 3.
+            backoff (float, optional): Base delay in seconds, the delay before retry n is random between 0 and backoff * 2 ** n. Defaults to 0.5.
+            max_backoff (float, optional): Cap of the delay in seconds. Defaults to 30.
+            methods (frozenset, optional): Methods that may be sent again, e.g. IDEMPOTENT_METHODS when a POST must not be repeated.
+                Defaults to every method.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.methods = methods
+
+    def should_retry(self, method:str, attempt:int, status:int = None) -> bool:
+        """Whether to retry after attempt (0 for the first one) failed, with status or with a timeout or connection error if None."""
+        if(attempt >= self.max_retries or (self.methods is not None and method.upper() not in self.methods)):
+            return False
+
+        return status is None or status in RetryPolicy.RETRY_STATUSES
+
+    def delay(self, attempt:int, retry_after:float = None) -> float:
+        """Seconds to wait before retrying after attempt failed ("full jitter"), at least retry_after when the server sent one."""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+        return max(delay, min(retry_after, self.max_backoff)) if retry_after is not None else delay
+
+
+class CircuitBreaker():
+    """Per-host circuit breaker shared by all requests of a process, hosts include their port so that services sharing a machine are separate.
+    After failure_threshold consecutive failures (5xx, timeouts, connection errors) the circuit of the host opens
+    and its requests fail fast for reset_timeout seconds. Then a single trial request is let through:
+    the circuit closes if it succeeds and opens again if it fails. A trial left without result (e.g. a cancelled request)
+    is replaced by another one after reset_timeout seconds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    __shared = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, failure_threshold:int = 5, reset_timeout:float = 30) -> None:
+        """
+        Args:
+            failure_threshold (int, optional): Consecutive failures opening the circuit. Defaults to 5.
+            reset_timeout (float, optional): Seconds the circuit stays open before a trial request. Defaults to 30.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # host: [consecutive failures, opened at (monotonic), trial request sent at (monotonic) or None]
+        self.__circuits = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def shared() -> "CircuitBreaker":
+        """Process wide breaker, used by default by every transport and by the Komga connector."""
+        if(CircuitBreaker.__shared is None):
+            with CircuitBreaker.__shared_lock:
+                if(CircuitBreaker.__shared is None):
+                    CircuitBreaker.__shared = CircuitBreaker()
+
+        return CircuitBreaker.__shared
+
+    def allow(self, url:str) -> bool:
+        """Whether a request to url's host may be sent. While half open, only the trial request is allowed."""
+        with self.__lock:
+            circuit = self.__circuits.get(urlsplit(url).netloc)
+
+            if(circuit is None or circuit[0] < self.failure_threshold):
+                return True
+
+            now = time.monotonic()
+
+            if(now - circuit[1] < self.reset_timeout or (circuit[2] is not None and now - circuit[2] < self.reset_timeout)):
+                return False
+
+            # Half open: this request is the trial, replacing a previous trial that never recorded its result.
+            circuit[2] = now
+
+            return True
+
+    def record_success(self, url:str) -> None:
+        with self.__lock:
+            self.__circuits.pop(urlsplit(url).netloc, None)
+
+    def record_failure(self, url:str) -> None:
+        with self.__lock:
+            circuit = self.__circuits.setdefault(urlsplit(url).netloc, [0, 0, None])
+            circuit[0] += 1
+
+            if(circuit[0] >= self.failure_threshold):
+                # Opened, or opened again after a failed trial.
+                circuit[1] = time.monotonic()
+                circuit[2] = None
+
+    def state(self, host:str) -> str:
+        """CLOSED, OPEN or HALF_OPEN (a trial request is in flight, or the next request is let through as one) for host,
+        e.g. "api.mangadex.org" or "localhost:25600".
+        """
+        with self.__lock:
+            circuit = self.__circuits.get(host)
+
+            if(circuit is None or circuit[0] < self.failure_threshold):
+                return CircuitBreaker.CLOSED
+
+            if(circuit[2] is not None or time.monotonic() - circuit[1] >= self.reset_timeout):
+                return CircuitBreaker.HALF_OPEN
+
+            return CircuitBreaker.OPEN
+
+    def reset(self, host:str = None) -> None:
+        """Close the circuit of host, or of every host."""
+        with self.__lock:
+            if(host is None):
+                self.__circuits.clear()
+
+            else:
+                self.__circuits.pop(host, None)
+
+
+class RetryLoop():
+    """Decisions of the retry loop of one request, shared by the provider transports and the Komga connectors.
+    The caller checks allow before every attempt, sends the request, reports its outcome with on_error or on_response
+    and, unless they return None, waits the returned seconds (time.sleep or asyncio.sleep) and sends it again.
+
+    Only timeouts, connection errors and 5xx count as failures of the host for the circuit breaker, any other answer,
+    429 included, means the host is up.
+
+    Usage:
+        loop = RetryLoop("GET", url, "MangaDex", retry_policy, circuit_breaker, rate_limiter, max_rate_limit_retries=3)
+        while(True):
+            if(not loop.allow()):
+                raise ...
+            response = session.get(url)
+            delay = loop.on_response(response.status_code, response.headers)
+            if(delay is None):
+                return response
+            time.sleep(delay)
+    """
+
+    DEFAULT_RETRY_AFTER = 5 # Seconds to back off when a 429 response has no Retry-After.
+
+    def __init__(self, method:str, url:str, service:str, retry_policy:RetryPolicy, circuit_breaker:CircuitBreaker,
+                 rate_limiter:RateLimiter = None, max_rate_limit_retries:int = 0) -> None:
+        """
+        Args:
+            method (str): Method of the request.
+            url (str): URL of the request, its host selects the circuit and the rate limiter bucket.
+            service (str): Name the metrics are recorded under, e.g. the provider name.
+            retry_policy (RetryPolicy): Retries of server errors, timeouts and connection errors.
+            circuit_breaker (CircuitBreaker): Breaker of the host.
+            rate_limiter (RateLimiter, optional): Penalized with the Retry-After of 429 responses. Defaults to None, 429 responses are final.
+            max_rate_limit_retries (int, optional): Retries of a request answered with 429. Defaults to 0.
+        """
+        self.method = method
+        self.url = url
+        self.service = service
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = rate_limiter
+        self.max_rate_limit_retries = max_rate_limit_retries if rate_limiter is not None else 0
+        self.attempt = 0
+        self.rate_limit_retries = 0
+        self.__metrics = MetricsRegistry.shared()
+
+    def allow(self) -> bool:
+        """Whether the request may be sent, False while the circuit of the host is open."""
+        if(self.circuit_breaker.allow(self.url)):
+            return True
+
+        self.__metrics.inc("circuit_rejected_total", service=self.service)
+
+        return False
+
+    def on_error(self, transient:bool) -> float:
+        """Seconds to wait before sending the request again after it raised, None to give up.
+
+        Args:
+            transient (bool): Whether the error was a timeout or a connection error. Other errors are not retried
+                and do not count as a failure of the host.
+        """
+        if(not transient):
+            return None
+
+        self.circuit_breaker.record_failure(self.url)
+
+        if(not self.retry_policy.should_retry(self.method, self.attempt)):
+            return None
+
+        return self.__retry("connection", self.retry_policy.delay(self.attempt))
+
+    def on_response(self, status:int, headers) -> float:
+        """Seconds to wait before sending the request again after an answer, None if the response is final.
+        Server errors are retried as retry_policy allows, 429 responses up to max_rate_limit_retries once their host
+        was penalized for the Retry-After (the rate limiter then holds the request back, so 0 is returned).
+        A final 429 means the rate limit retries are exhausted.
+
+        Args:
+            status (int): Status code of the response.
+            headers (Mapping): Response headers, looked up case-insensitively.
+        """
+        if(status >= 500):
+            self.circuit_breaker.record_failure(self.url)
+
+            if(not self.retry_policy.should_retry(self.method, self.attempt, status)):
+                return None
+
+            return self.__retry("5xx", self.retry_policy.delay(self.attempt, RateLimiter.parse_retry_after(headers.get("Retry-After"), None)))
+
+        self.circuit_breaker.record_success(self.url)
+
+        if(status != 429 or self.rate_limit_retries >= self.max_rate_limit_retries):
+            return None
+
+        self.rate_limit_retries += 1
+        self.__metrics.inc("http_retries_total", service=self.service, reason="429")
+        # Every request to the host waits, not only this one.
+        self.rate_limiter.penalize(self.url, RateLimiter.parse_retry_after(headers.get("Retry-After"), RetryLoop.DEFAULT_RETRY_AFTER))
+
+        return 0
+
+    def __retry(self, reason:str, delay:float) -> float:
+        self.__metrics.inc("http_retries_total", service=self.service, reason=reason)
+        self.attempt += 1
+
+        return delay
@@ -0,0 +1,23 @@
+from dataclasses import dataclass, field
+
+from .manga_metadata import MangaMetadata
+
+
+@dataclass
+class SearchCandidate():
+    """Lightweight search result, populated from the search response only.
+    Enough to rank candidates by title, and promotable to MangaMetadata with to_metadata.
+    Complete candidates were returned with every field of MangaMetadata and are promoted without a request.
+    """
+    provider: str
+    id_token: str
+    titles: dict
+    summary: str = None
+    genres: list[str] = None
+    cover_url: str = None
+    complete: bool = False
+    loader: object = field(default=None, repr=False, compare=False) # Callable[[], MangaMetadata]
+
+    def to_metadata(self) -> MangaMetadata:
+        """Full metadata of the candidate, requested from the provider unless the candidate is complete."""
+        return self.loader()
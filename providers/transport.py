@@ -0,0 +1,153 @@
+import time
+import requests
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+from .rate_limiter import RateLimiter
+from .retry import RetryPolicy, CircuitBreaker, RetryLoop
+from .provider_exceptions import ProviderExceptions, RateLimitedError, ResponseTooLargeError, CircuitOpenError
+from .metrics import MetricsRegistry
+
+
+class HttpTransport():
+    """Pooled HTTP session used by every request of a provider, covers included.
+    Connections are kept alive and reused, so bulk runs do not pay a TCP+TLS handshake per request.
+    Requests are scheduled through a per-host RateLimiter, 429 responses are retried after their Retry-After.
+    Server errors, timeouts and connection errors are retried with backoff (RetryPolicy),
+    and a host failing repeatedly is not sent requests for a while (CircuitBreaker).
+    Every request is recorded in MetricsRegistry.shared() under the transport name.
+    """
+
+    DEFAULT_HEADERS = {"User-Agent": "manga_metadata_retrieval"}
+
+    def __init__(self, pool_connections:int = 10, pool_maxsize:int = 10, timeout:float = 30, headers:dict = None, session:requests.Session = None,
+                 rate_limiter:RateLimiter = None, max_rate_limit_retries:int = 3, name:str = "HTTP", retry_policy:RetryPolicy = None,
+                 circuit_breaker:CircuitBreaker = None) -> None:
+        """
+        Args:
+            pool_connections (int, optional): Number of hosts to keep pools for. Defaults to 10.
+            pool_maxsize (int, optional): Maximum connections kept per host, should match the number of worker threads. Defaults to 10.
+            timeout (float | tuple[float, float], optional): Default timeout of a request in seconds, or (connect, read) timeouts. Defaults to 30.
+            headers (dict, optional): Headers sent with every request, merged over DEFAULT_HEADERS.
+            session (requests.Session, optional): Session to use instead of a new one, e.g. for proxies or tests.
+            rate_limiter (RateLimiter, optional): Scheduler of the requests. Defaults to RateLimiter.shared().
+            max_rate_limit_retries (int, optional): Retries of a request answered with 429. Defaults to 3.
+            name (str, optional): Name used in raised exceptions, the provider name for providers.
+            retry_policy (RetryPolicy, optional): Retries of server errors, timeouts and connection errors. Defaults to RetryPolicy().
+            circuit_breaker (CircuitBreaker, optional): Breaker failing fast for hosts that keep failing. Defaults to CircuitBreaker.shared().
+        """
+        self.name = name
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter.shared()
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker.shared()
+        self.session = session if session is not None else requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.session.headers.update(HttpTransport.DEFAULT_HEADERS)
+        self.session.headers.update(headers or {})
+
+    def request(self, method:str, url:str, **kwargs) -> Response:
+        """Send a request once the rate limiter permits it.
+        Server errors (5xx) are returned once retry_policy gives up, so the caller still decides what a status means.
+        Raise ProviderExceptions.RateLimitedError if it is still answered with 429 after max_rate_limit_retries,
+        ProviderExceptions.CircuitOpenError without sending it if the host's circuit is open,
+        and ProviderExceptions if it still times out or cannot connect after the retries.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        metrics = MetricsRegistry.shared()
+        loop = RetryLoop(method, url, self.name, self.retry_policy, self.circuit_breaker, self.rate_limiter, self.max_rate_limit_retries)
+
+        while(True):
+            if(not loop.allow()):
+                raise CircuitOpenError(f"Too many consecutive failures, requests are paused. {url}", self.name)
+
+            with metrics.time("rate_limit_wait_seconds", service=self.name):
+                self.rate_limiter.acquire(url)
+
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+
+            except requests.RequestException as e:
+                delay = loop.on_error(isinstance(e, (requests.ConnectionError, requests.Timeout)))
+
+                if(delay is None):
+                    raise ProviderExceptions(f"{type(e).__name__} after {loop.attempt} retries. {url}", self.name)
+
+                time.sleep(delay)
+                continue
+
+            body = response.request.body
+            metrics.record_request(
+                self.name,
+                method,
+                response.status_code,
+                time.perf_counter() - start,
+                # Streamed bodies are not read yet, only their announced size is known.
+                int(response.headers.get("Content-Length", 0)) if kwargs.get("stream") else len(response.content),
+                len(body) if body is not None else 0
+            )
+
+            delay = loop.on_response(response.status_code, response.headers)
+
+            if(delay is None):
+                if(response.status_code == 429):
+                    response.close()
+                    raise RateLimitedError(f"Still rate limited after {self.max_rate_limit_retries} retries. {url}", self.name)
+
+                return response
+
+            # Streamed responses keep their connection until closed.
+            response.close()
+            time.sleep(delay)
+
+    def get(self, url:str, **kwargs) -> Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url:str, **kwargs) -> Response:
+        return self.request("POST", url, **kwargs)
+
+    def download(self, url:str, max_bytes:int = None, chunk_size:int = 65536, **kwargs) -> bytes:
+        """GET the body of url, streamed so that at most max_bytes are ever held in memory.
+        Raise ProviderExceptions.ResponseTooLargeError as soon as the body exceeds max_bytes,
+        and ProviderExceptions if the response is not successful.
+
+        Args:
+            url (str): URL to download.
+            max_bytes (int, optional): Size limit of the body. Defaults to no limit.
+            chunk_size (int, optional): Bytes read at once. Defaults to 64KB.
+
+        Returns:
+            bytes: Response body.
+        """
+        with self.request("GET", url, stream=True, **kwargs) as response:
+            if(response.status_code != 200):
+                raise ProviderExceptions(f"Download failed with ({response.status_code}). {url}", self.name)
+
+            if(max_bytes is not None and int(response.headers.get("Content-Length", 0)) > max_bytes):
+                raise ResponseTooLargeError(f"Response of {response.headers['Content-Length']} bytes exceeds {max_bytes} bytes. {url}", self.name)
+
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size):
+                body += chunk
+
+                if(max_bytes is not None and len(body) > max_bytes):
+                    # Content-Length was missing or wrong.
+                    raise ResponseTooLargeError(f"Response exceeds {max_bytes} bytes. {url}", self.name)
+
+        return bytes(body)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "HttpTransport":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()